@@ -0,0 +1,418 @@
+from typing import List, Optional
+from urllib.parse import urlparse
+from datetime import timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Response, Header, Request, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, func, delete
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from metrics import instrument_engine, register_pool, timed
+
+from main import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, TITLE_PLACEHOLDER,
+    LAYOUT_CHUNK_SIZE, get_settings, engine_options, oauth2_scheme, get_google_cert_store, create_access_token,
+    User, Category, Site, CurrentUser,
+    Token, GoogleLoginRequest, UserResponse, SiteCreate, SiteUpdate, SiteResponse,
+    CategoryCreate, CategoryUpdate, CategoryResponse, OrderUpdateRequest, MoveSiteRequest, LayoutRequest, LayoutResponse,
+    user_cache, token_cache, decode_token, cache_token, revoked_token_query, revocation_statement, expired_revocations_delete,
+    user_identity_query, cache_current_user,
+    dashboard_cache, dashboard_query, build_dashboard, dump_json, board_version_bump, board_version_query,
+    ChangesResponse, CategorySummary, category_summary_query, category_changes_query, site_changes_query, tombstones_query,
+    build_changes, stamp_changed, tombstone, category_sites_tombstones_insert, changes_state_query, needs_full_sync, expired_tombstones_query, prune_tombstones_statements,
+    make_etag, etag_matches, sites_with_owner_query, apply_site_metadata, fetch_site_metadata,
+    category_order_statement, site_layout_statement, category_order_items, site_layout_items,
+    ImportResponse, BookmarkImport, queue_site_metadata, read_bookmark_batches, export_query, export_response,
+    EXPORTERS, EXPORT_CHUNK_SIZE,
+    SearchResponse, PrefixIndex, search_index_cache, search_index_builds, cached_search_index, pg_search_query, search_rows_query, search_response,
+)
+
+# --- asyncio版のDB接続とエンドポイント (settings.async_db のときに main.create_app から登録される) ---
+# 同期版と同じSQL文の組み立て関数を使い、DBアクセスだけを await に置き換えています。
+
+def async_database_url(url: str, statement_cache_size: int) -> str:
+    """同期用のURLを asyncpg / aiosqlite のドライバ指定に置き換えます。"""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        url = url.set(drivername="postgresql+asyncpg").update_query_dict(
+            {"prepared_statement_cache_size": str(statement_cache_size)}
+        )
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url.render_as_string(hide_password=False)
+
+class _LazyAsyncSessionmaker(async_sessionmaker):
+    """main.SessionLocal と同じく、最初のセッションを作るときにエンジンを作ります (ドライバの読み込みもそのとき)。"""
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            get_async_engine()
+        return super().__call__(**local_kw)
+
+async_engine = None
+AsyncSessionLocal = _LazyAsyncSessionmaker(autoflush=False, expire_on_commit=False)
+
+def configure_database():
+    """main.settings の database_url から async 用のエンジンを作り、AsyncSessionLocal をそこに向けます。"""
+    global async_engine
+    settings = get_settings()
+    url = async_database_url(settings.database_url, settings.db_statement_cache_size)
+    async_engine = create_async_engine(url, **engine_options(url, AsyncAdaptedQueuePool))
+    instrument_engine(async_engine.sync_engine)
+    register_pool("async", async_engine.pool)
+    AsyncSessionLocal.configure(bind=async_engine)
+
+def get_async_engine():
+    if async_engine is None:
+        configure_database()
+    return async_engine
+
+def reset_async_engine():
+    """次に使うときに main.settings からエンジンを作り直します。"""
+    global async_engine
+    async_engine = None
+    AsyncSessionLocal.configure(bind=None)
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
+
+router = APIRouter()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_current_user_async(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)):
+    user_id = token_cache.get(token)
+    if user_id is None:
+        user_id, exp = decode_token(token)
+        user_id = cache_token(token, user_id, exp, (await db.execute(revoked_token_query(token))).first())
+    current_user = user_cache.get(user_id)
+    if current_user is None:
+        with timed("user_lookup"):
+            current_user = cache_current_user((await db.execute(user_identity_query(user_id))).first())
+    return current_user
+
+async def revoke_token(db: AsyncSession, token: str):
+    """main.revoke_token のasync版。"""
+    token_cache.pop(token)
+    await db.execute(expired_revocations_delete())
+    stmt = revocation_statement(db.get_bind().dialect.name, token)
+    if stmt is not None:
+        await db.execute(stmt)
+
+async def bump_board_version(db: AsyncSession, user_id: int) -> int:
+    return (await db.execute(board_version_bump(user_id))).scalar_one()
+
+async def prune_tombstones(db: AsyncSession, user_id: int):
+    """main.prune_tombstones のasync版。"""
+    pruned_seq = (await db.execute(expired_tombstones_query(user_id))).scalar()
+    if pruned_seq is not None:
+        for stmt in prune_tombstones_statements(user_id, pruned_seq):
+            await db.execute(stmt)
+
+async def _owned_category(db: AsyncSession, category_id: int, user_id: int) -> Optional[Category]:
+    return (await db.execute(select(Category).where(Category.id == category_id, Category.user_id == user_id))).scalar_one_or_none()
+
+async def _owned_site(db: AsyncSession, site_id: int, user_id: int) -> Optional[Site]:
+    stmt = select(Site).join(Category, Site.category_id == Category.id).where(Site.id == site_id, Category.user_id == user_id)
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+@router.post("/api/auth/google", response_model=Token)
+async def google_login(request: GoogleLoginRequest, db: AsyncSession = Depends(get_async_db)):
+    google_client_id = get_settings().google_client_id
+    if not google_client_id or "【" in google_client_id:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Google Client ID is not configured on the server",
+        )
+    try:
+        # 鍵の更新でネットワークを使うことがあるのでスレッドプールで実行
+        with timed("google_verify"):
+            idinfo = await run_in_threadpool(get_google_cert_store().verify, request.token, google_client_id)
+        google_id = idinfo['sub']
+        email = idinfo['email']
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Google token",
+        )
+
+    user = (await db.execute(select(User).where(User.google_id == google_id))).scalar_one_or_none()
+    if not user:
+        user = User(google_id=google_id, email=email)
+        db.add(user)
+        await db.commit()
+
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(data={"sub": user.email, "user_id": user.id}, expires_delta=access_token_expires)
+    return {"access_token": access_token, "token_type": "bearer"}
+
+@router.get("/api/users/me", response_model=UserResponse)
+async def read_users_me(current_user: CurrentUser = Depends(get_current_user_async)):
+    return current_user
+
+@router.get("/api/categories", response_model=List[CategoryResponse])
+async def read_categories(db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async), if_none_match: Optional[str] = Header(None)):
+    version = (await db.execute(board_version_query(current_user.id))).scalar_one()
+    etag = make_etag(current_user.id, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = dashboard_cache.get(current_user.id)
+    if cached is not None and cached[0] == version:
+        body = cached[1]
+    else:
+        rows = (await db.execute(dashboard_query(current_user.id))).all()
+        with timed("serialize"):
+            body = dump_json(build_dashboard(rows))
+        dashboard_cache.set(current_user.id, (version, body))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.get("/api/changes", response_model=ChangesResponse)
+async def read_changes(since: int = Query(0, ge=0), db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    version, pruned_seq = (await db.execute(changes_state_query(current_user.id))).one()
+    full = needs_full_sync(since, version, pruned_seq)
+    if full:
+        since = -1 # change_seq=0 (差分同期の導入前からある行) も含める
+    body = build_changes(
+        version, full,
+        (await db.execute(category_changes_query(current_user.id, since))).all(),
+        (await db.execute(site_changes_query(current_user.id, since))).all(),
+        [] if full else (await db.execute(tombstones_query(current_user.id, since))).all(),
+    )
+    return Response(content=dump_json(body), media_type="application/json", headers={"Cache-Control": "private, no-cache"})
+
+@router.get("/api/categories/names", response_model=List[CategorySummary])
+async def read_category_names(db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    rows = (await db.execute(category_summary_query(current_user.id))).all()
+    return Response(content=dump_json([{"id": id_, "name": name, "display_order": order} for id_, name, order in rows]), media_type="application/json")
+
+@router.post("/api/categories", response_model=CategoryResponse)
+async def create_category(category: CategoryCreate, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    max_order = (await db.execute(select(func.count()).select_from(Category).where(Category.user_id == current_user.id))).scalar_one()
+    db_category = Category(name=category.name, display_order=max_order, user_id=current_user.id)
+    db.add(db_category)
+    db_category.change_seq = await bump_board_version(db, current_user.id)
+    await db.commit()
+    return CategoryResponse(id=db_category.id, name=db_category.name, display_order=db_category.display_order, sites=[])
+
+@router.put("/api/categories/{category_id}", response_model=CategoryResponse)
+async def update_category(category_id: int, category: CategoryUpdate, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    db_category = await _owned_category(db, category_id, current_user.id)
+    if db_category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    db_category.name = category.name
+    db_category.change_seq = await bump_board_version(db, current_user.id)
+    await db.commit()
+    # sites は遅延ロードできないので、同期版と同じ内容になるよう明示的に読み込む
+    sites = (await db.execute(select(Site).where(Site.category_id == category_id).order_by(Site.display_order))).scalars().all()
+    return CategoryResponse(
+        id=db_category.id, name=db_category.name, display_order=db_category.display_order,
+        sites=[SiteResponse.model_validate(site) for site in sites],
+    )
+
+@router.delete("/api/categories/{category_id}", status_code=204)
+async def delete_category(category_id: int, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    db_category = await _owned_category(db, category_id, current_user.id)
+    if db_category is None:
+        raise HTTPException(status_code=404, detail="Category not found")
+    change_seq = await bump_board_version(db, current_user.id)
+    await db.execute(category_sites_tombstones_insert(current_user.id, category_id, change_seq))
+    # ORMのcascadeは遅延ロードが必要になるため、サイトは先にまとめて削除する
+    await db.execute(delete(Site).where(Site.category_id == category_id))
+    await db.delete(db_category)
+    db.add(tombstone(current_user.id, "category", category_id, change_seq))
+    await prune_tombstones(db, current_user.id)
+    await db.commit()
+    return
+
+async def save_site_metadata(results: dict):
+    async with AsyncSessionLocal() as db:
+        changed: dict = {}
+        for db_site, user_id in (await db.execute(sites_with_owner_query(list(results)))).all():
+            if apply_site_metadata(db_site, results[db_site.id]):
+                changed.setdefault(user_id, []).append(db_site)
+        for user_id, db_sites in changed.items():
+            stamp_changed(db_sites, await bump_board_version(db, user_id))
+        await db.commit()
+
+async def fill_site_metadata(sites: List[tuple]):
+    await save_site_metadata(await fetch_site_metadata(sites))
+
+@router.post("/api/sites", response_model=SiteResponse)
+async def create_site(site: SiteCreate, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    category = await _owned_category(db, site.category_id, current_user.id)
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found for this user")
+
+    title = site.title or TITLE_PLACEHOLDER
+    favicon_url = f"https://www.google.com/s2/favicons?domain={urlparse(site.url).netloc}&sz=32"
+    max_order = (await db.execute(select(func.count()).select_from(Site).where(Site.category_id == site.category_id))).scalar_one()
+    db_site = Site(title=title, url=site.url, category_id=site.category_id, favicon_url=favicon_url, display_order=max_order)
+    db.add(db_site)
+    db_site.change_seq = await bump_board_version(db, current_user.id)
+    await db.commit()
+    if title == TITLE_PLACEHOLDER:
+        background_tasks.add_task(fill_site_metadata, [(db_site.id, db_site.url)])
+    return db_site
+
+@router.put("/api/sites/{site_id}", response_model=SiteResponse)
+async def update_site_title(site_id: int, site_update: SiteUpdate, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    db_site = await _owned_site(db, site_id, current_user.id)
+    if not db_site:
+        raise HTTPException(status_code=404, detail="Site not found")
+    db_site.title = site_update.title
+    db_site.change_seq = await bump_board_version(db, current_user.id)
+    await db.commit()
+    return db_site
+
+@router.delete("/api/sites/{site_id}", status_code=204)
+async def delete_site(site_id: int, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    db_site = await _owned_site(db, site_id, current_user.id)
+    if db_site is None:
+        raise HTTPException(status_code=404, detail="Site not found")
+    await db.delete(db_site)
+    db.add(tombstone(current_user.id, "site", site_id, await bump_board_version(db, current_user.id)))
+    await prune_tombstones(db, current_user.id)
+    await db.commit()
+    return
+
+@router.get("/api/sites/search", response_model=SearchResponse)
+async def search_sites(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async),
+):
+    if db.get_bind().dialect.name == "postgresql":
+        rows = (await db.execute(pg_search_query(current_user.id, q, limit, offset))).all()
+        return search_response([(float(row[-1]), row[:-1]) for row in rows], limit, offset)
+
+    version = (await db.execute(board_version_query(current_user.id))).scalar_one()
+
+    async def build() -> PrefixIndex:
+        index = cached_search_index(current_user.id, version)
+        if index is None:
+            rows = (await db.execute(search_rows_query(current_user.id))).all()
+            index = await run_in_threadpool(PrefixIndex, rows) # 大きなボードでは構築に時間がかかるのでイベントループを塞がない
+            search_index_cache.set(current_user.id, (version, index))
+        return index
+
+    index = cached_search_index(current_user.id, version)
+    if index is None:
+        index = await search_index_builds.do_async((current_user.id, version), build)
+    return search_response(index.search(q, limit + 1, offset), limit, offset)
+
+async def _execute_in_chunks(db: AsyncSession, build_statement, user_id: int, items: list, change_seq: int) -> int:
+    dialect_name = db.get_bind().dialect.name
+    updated = 0
+    for start in range(0, len(items), LAYOUT_CHUNK_SIZE):
+        stmt, params = build_statement(dialect_name, user_id, items[start:start + LAYOUT_CHUNK_SIZE], change_seq)
+        result = await (db.execute(stmt, params) if params is not None else db.execute(stmt))
+        updated += result.rowcount
+    return updated
+
+async def reorder_categories(db: AsyncSession, user_id: int, order_updates: List[OrderUpdateRequest], change_seq: int) -> bool:
+    items = category_order_items(order_updates)
+    return await _execute_in_chunks(db, category_order_statement, user_id, items, change_seq) == len(items)
+
+async def reorder_sites(db: AsyncSession, user_id: int, order_updates: List[OrderUpdateRequest], change_seq: int) -> bool:
+    items = site_layout_items(order_updates)
+    return await _execute_in_chunks(db, site_layout_statement, user_id, items, change_seq) == len(items)
+
+@router.post("/api/layout", response_model=LayoutResponse)
+async def apply_layout(layout: LayoutRequest, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    version = await bump_board_version(db, current_user.id)
+    if not await reorder_categories(db, current_user.id, layout.categories, version) or not await reorder_sites(db, current_user.id, layout.sites, version):
+        await db.rollback()
+        raise HTTPException(status_code=403, detail="Permission denied to update one or more categories or sites")
+    await db.commit()
+    return {"board_version": version}
+
+@router.post("/api/update-order/categories")
+async def update_categories_order(order_updates: List[OrderUpdateRequest], db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    version = await bump_board_version(db, current_user.id)
+    await reorder_categories(db, current_user.id, order_updates, version)
+    await db.commit()
+    return {"message": "Categories order updated", "board_version": version}
+
+@router.post("/api/update-order/sites")
+async def update_sites_order(order_updates: List[OrderUpdateRequest], db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    version = await bump_board_version(db, current_user.id)
+    if not await reorder_sites(db, current_user.id, order_updates, version):
+        await db.rollback()
+        raise HTTPException(status_code=403, detail="Permission denied to update one or more sites")
+    await db.commit()
+    return {"message": "Sites order updated", "board_version": version}
+
+@router.post("/api/move-site")
+async def move_site(move_request: MoveSiteRequest, db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async)):
+    site_to_move = await _owned_site(db, move_request.site_id, current_user.id)
+    dest_category = await _owned_category(db, move_request.new_category_id, current_user.id)
+
+    if not site_to_move or not dest_category:
+        raise HTTPException(status_code=404, detail="Site or destination category not found or permission denied")
+
+    site_to_move.category_id = move_request.new_category_id
+    site_to_move.change_seq = await bump_board_version(db, current_user.id)
+    await db.commit()
+    return {"message": "Site moved successfully"}
+
+async def run_import_batch(db: AsyncSession, job: BookmarkImport, items):
+    steps = job.batch_steps(items)
+    try:
+        stmt, params = next(steps)
+        while True:
+            result = await (db.execute(stmt, params) if params is not None else db.execute(stmt))
+            stmt, params = steps.send(result)
+    except StopIteration:
+        pass
+
+async def finish_import(db: AsyncSession, job: BookmarkImport) -> int:
+    if not job.created:
+        version = (await db.execute(board_version_query(job.user_id))).scalar_one()
+    else:
+        version = await bump_board_version(db, job.user_id)
+        for stmt in job.stamp_statements(version):
+            await db.execute(stmt)
+    await db.commit()
+    return version
+
+@router.post("/api/import", response_model=ImportResponse)
+async def import_bookmarks(
+    request: Request, background_tasks: BackgroundTasks,
+    format: Optional[str] = Query(None, pattern="^(html|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db), current_user: CurrentUser = Depends(get_current_user_async),
+):
+    job = BookmarkImport(current_user.id)
+    try:
+        async for batch in read_bookmark_batches(request, format):
+            await run_import_batch(db, job, batch)
+        version = await finish_import(db, job)
+    except ValueError as exc:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Invalid bookmark file: {exc}")
+    if job.untitled:
+        background_tasks.add_task(queue_site_metadata, job.untitled, fill_site_metadata)
+    return job.result(version)
+
+async def stream_export(user_id: int, fmt: str):
+    exporter = EXPORTERS[fmt]()
+    buffer = exporter.start()
+    async with AsyncSessionLocal() as db:
+        async for row in await db.stream(export_query(user_id)):
+            buffer += exporter.row(*row)
+            if len(buffer) >= EXPORT_CHUNK_SIZE:
+                yield buffer.encode("utf-8")
+                buffer = ""
+    yield (buffer + exporter.end()).encode("utf-8")
+
+@router.get("/api/export")
+async def export_bookmarks(format: str = Query("ndjson", pattern="^(html|ndjson)$"), current_user: CurrentUser = Depends(get_current_user_async)):
+    return export_response(stream_export(current_user.id, format), format)
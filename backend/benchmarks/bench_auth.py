@@ -0,0 +1,73 @@
+"""get_current_user の1リクエストあたりの認証コストを計測するマイクロベンチマーク。
+
+    cd backend
+    python benchmarks/bench_auth.py [--iterations 5000]
+
+DATABASE_URL が未設定なら一時的なSQLiteファイルを使います。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+from fastapi import HTTPException  # noqa: E402
+from jose import jwt  # noqa: E402
+
+import main  # noqa: E402
+
+
+def legacy_get_current_user(db, token):
+    # 変更前の実装: 毎回 jwt.decode + usersテーブルへの問い合わせ
+    payload = jwt.decode(token, main.settings.secret_key, algorithms=[main.ALGORITHM])
+    user = db.query(main.User).filter(main.User.id == payload.get("user_id")).first()
+    if user is None:
+        raise HTTPException(status_code=401)
+    return user
+
+
+def cached_get_current_user(db, token):
+    return main.get_current_user(db=db, token=token)
+
+
+def measure(fn, token, iterations):
+    timings = []
+    db = main.SessionLocal()
+    try:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            fn(db, token)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+            db.expire_all() # リクエストごとに新しいセッションを使う状況に近づける
+    finally:
+        db.close()
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    main.init_db()
+    db = main.SessionLocal()
+    user = main.User(email="bench@example.com", google_id="bench")
+    db.add(user)
+    db.commit()
+    token = main.create_access_token(data={"sub": user.email, "user_id": user.id})
+    db.close()
+
+    print(f"{args.iterations} iterations")
+    for name, fn in [("legacy (decode + query)", legacy_get_current_user), ("cached", cached_get_current_user)]:
+        p50, p99 = measure(fn, token, args.iterations)
+        print(f"{name:24s} p50={p50:.1f}us  p99={p99:.1f}us")
+    print("cache:", "token", main.token_cache.stats(), "user", main.user_cache.stats())
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,104 @@
+"""GET /api/categories のクエリ数とレイテンシを計測するベンチマーク。
+
+    cd backend
+    python benchmarks/bench_categories.py [--categories 50] [--sites 200] [--iterations 50]
+
+DATABASE_URL が未設定なら一時的なSQLiteファイルを使います。
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench.db")
+
+from pydantic import TypeAdapter  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+from typing import List  # noqa: E402
+
+import main  # noqa: E402
+
+
+def seed(db, n_categories, n_sites):
+    user = main.User(email="bench@example.com", google_id="bench")
+    db.add(user)
+    db.commit()
+    for c in range(n_categories):
+        category = main.Category(name=f"category {c}", display_order=c, user_id=user.id)
+        db.add(category)
+        db.flush()
+        db.execute(insert(main.Site), [
+            {"title": f"site {c}-{s}", "url": f"https://example.com/{c}/{s}", "display_order": s,
+             "favicon_url": "https://www.google.com/s2/favicons?domain=example.com&sz=32", "category_id": category.id}
+            for s in range(n_sites)
+        ])
+    db.commit()
+    db.refresh(user)
+    db.expunge(user)
+    return user
+
+
+_adapter = TypeAdapter(List[main.CategoryResponse])
+
+
+def legacy_read_categories(db, user):
+    # 変更前の実装: ORMで取得し、response_model経由でカテゴリごとにsitesを遅延ロード
+    categories = db.query(main.Category).filter(main.Category.user_id == user.id).order_by(main.Category.display_order).all()
+    return _adapter.dump_json(_adapter.validate_python(categories, from_attributes=True))
+
+
+def current_read_categories(db, user):
+    main.dashboard_cache.clear() # キャッシュなしのクエリ+シリアライズのコストを測る
+    return main.read_categories(db=db, current_user=user, if_none_match=None).body
+
+
+def measure(fn, user, iterations):
+    queries = 0
+
+    def count(*_):
+        nonlocal queries
+        queries += 1
+
+    event.listen(main.engine, "before_cursor_execute", count)
+    timings = []
+    try:
+        for _ in range(iterations):
+            db = main.SessionLocal()
+            start = time.perf_counter()
+            body = fn(db, user)
+            timings.append((time.perf_counter() - start) * 1000)
+            db.close()
+    finally:
+        event.remove(main.engine, "before_cursor_execute", count)
+    timings.sort()
+    return {
+        "queries/request": queries / iterations,
+        "p50 ms": statistics.median(timings),
+        "p99 ms": timings[min(len(timings) - 1, int(len(timings) * 0.99))],
+        "bytes": len(body),
+    }
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--sites", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    main.init_db()
+    db = main.SessionLocal()
+    user = seed(db, args.categories, args.sites)
+    db.close()
+
+    print(f"{args.categories} categories x {args.sites} sites, {args.iterations} iterations")
+    for name, fn in [("legacy (ORM + lazy load)", legacy_read_categories), ("current (single query)", current_read_categories)]:
+        result = measure(fn, user, args.iterations)
+        print(f"{name:28s} " + "  ".join(f"{k}={v:.2f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main_()
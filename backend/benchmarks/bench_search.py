@@ -0,0 +1,111 @@
+"""GET /api/sites/search のレイテンシを、1ユーザーに大量のサイトがある状態で計測するベンチマーク。
+
+    cd backend
+    python benchmarks/bench_search.py [--sites 100000] [--categories 100] [--iterations 20]
+
+DATABASE_URL が未設定なら一時的なSQLiteファイル (メモリ内の前方一致インデックス) を使います。
+PostgreSQLでは `python main.py migrate` と同じ手順でGINインデックスを作成してから計測し、
+実行計画 (EXPLAIN) にインデックスが使われているかも表示します。
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/search.db")
+
+from sqlalchemy import insert, text  # noqa: E402
+
+import main  # noqa: E402
+
+WORDS = [
+    "python", "rust", "react", "docker", "postgres", "recipe", "travel", "news", "music", "design",
+    "kubernetes", "guide", "tutorial", "blog", "weather", "finance", "manga", "anime", "camera", "garden",
+]
+HOSTS = ["github.com", "qiita.com", "zenn.dev", "example.com", "docs.example.org", "news.example.jp", "youtube.com", "wikipedia.org"]
+QUERIES = ["python", "pyth", "docker guide", "zenn", "github.com/react", "no-such-word", "wiki", "n"]
+
+
+def seed(db, n_sites, n_categories):
+    rng = random.Random(0)
+    user = main.User(email=f"search-{time.time()}@example.com", google_id=f"search-{time.time()}")
+    db.add(user)
+    db.commit()
+    category_ids = []
+    for c in range(n_categories):
+        category = main.Category(name=f"category {c}", display_order=c, user_id=user.id)
+        db.add(category)
+        db.flush()
+        category_ids.append(category.id)
+    rows = []
+    for i in range(n_sites):
+        title = " ".join(rng.sample(WORDS, 3)) + f" {i}"
+        url = f"https://{rng.choice(HOSTS)}/{rng.choice(WORDS)}/{i}"
+        rows.append({"title": title, "url": url, "display_order": i, "category_id": category_ids[i % n_categories]})
+        if len(rows) == 5000:
+            db.execute(insert(main.Site), rows)
+            rows = []
+    if rows:
+        db.execute(insert(main.Site), rows)
+    db.commit()
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("ANALYZE sites"))
+        db.execute(text("ANALYZE categories"))
+        db.commit()
+    return main.CurrentUser(id=user.id, email=user.email)
+
+
+def search(db, user, q):
+    return main.search_sites(q=q, limit=20, offset=0, db=db, current_user=user)
+
+
+def explain(db, user, q):
+    # literal_binds だと LIKE の % がエスケープされたまま残るので、バインド変数のままドライバに渡す
+    compiled = main.pg_search_query(user.id, q, 20, 0).compile(dialect=db.get_bind().dialect)
+    return [row[0] for row in db.connection().exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)]
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sites", type=int, default=100_000)
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    changes = main.init_db()
+    db = main.SessionLocal()
+    start = time.perf_counter()
+    user = seed(db, args.sites, args.categories)
+    dialect = db.get_bind().dialect.name
+    print(f"{dialect}: {args.sites} sites in {args.categories} categories (seeded in {time.perf_counter() - start:.1f}s, migrate changes={len(changes)})")
+
+    if dialect != "postgresql":
+        main.search_index_cache.clear()
+        start = time.perf_counter()
+        search(db, user, QUERIES[0])
+        print(f"first search (builds the in-memory index): {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    for q in QUERIES:
+        timings = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            result = search(db, user, q)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"q={q!r:22s} p50={statistics.median(timings):7.2f}ms p99={timings[min(len(timings) - 1, int(len(timings) * 0.99))]:7.2f}ms hits={len(result['results'])}")
+
+    if dialect == "postgresql":
+        plan = explain(db, user, QUERIES[0])
+        uses_index = any("ix_sites_" in line for line in plan)
+        print(f"EXPLAIN q={QUERIES[0]!r} (uses search indexes: {uses_index})")
+        for line in plan:
+            print("  " + line)
+    db.close()
+
+
+if __name__ == "__main__":
+    main_()
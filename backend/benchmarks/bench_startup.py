@@ -0,0 +1,107 @@
+"""起動時間 (import main の時間と、uvicorn の起動から最初のレスポンスまで) を計測するベンチマーク。
+
+    cd backend
+    python benchmarks/bench_startup.py [--runs 5] [--workers 1,4] [--modes sync,async]
+
+DATABASE_URL が未設定なら一時的なSQLiteファイル (async版は aiosqlite) を使います。
+テーブルは最初に1回だけ作成し、各サーバーは DB_AUTO_MIGRATE=0 で起動します
+(--auto-migrate を付けると、起動のたびにテーブル作成を行う場合と比較します)。
+"""
+import argparse
+import os
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/startup.db")
+os.environ.setdefault("SECRET_KEY", secrets.token_hex(32)) # PostgreSQLに向けたときも起動できるように (uvicorn にも引き継ぐ)
+
+IMPORT_SNIPPET = (
+    "import sys, time; t = time.perf_counter(); import main; "
+    "print(time.perf_counter() - t); "
+    "print(','.join(m for m in ('bs4', 'jose', 'google.auth', 'requests', 'httpx') if m in sys.modules))"
+)
+
+
+def seed():
+    import main
+
+    main.init_db()
+    db = main.SessionLocal()
+    try:
+        user = main.User(email=f"startup-{time.time()}@example.com", google_id=f"startup-{time.time()}")
+        db.add(user)
+        db.commit()
+        return main.create_access_token(data={"sub": user.email, "user_id": user.id})
+    finally:
+        db.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env):
+    result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True)
+    seconds, loaded = (result.stdout.splitlines() + [""])[:2]
+    return float(seconds), loaded
+
+
+def measure_first_response(env, token, workers, timeout=30):
+    """プロセスの起動から、認証付きのAPI (DBアクセスを含む) が200を返すまでの時間。"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        deadline = started + timeout
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", headers={"Authorization": f"Bearer {token}"}) as client:
+            while time.perf_counter() < deadline:
+                try:
+                    if client.get("/api/users/me").status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.01)
+        raise RuntimeError("server did not start")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", default="1,4")
+    parser.add_argument("--modes", default="sync,async")
+    parser.add_argument("--auto-migrate", action="store_true", help="起動のたびにテーブル作成を行う場合も計測する")
+    args = parser.parse_args()
+
+    token = seed()
+    print(f"{os.environ['DATABASE_URL']}  runs={args.runs}")
+    for mode in args.modes.split(","):
+        migrate_options = ("0", "1") if args.auto_migrate else ("0",)
+        for auto_migrate in migrate_options:
+            env = dict(os.environ, ASYNC_DB="1" if mode == "async" else "0", DB_AUTO_MIGRATE=auto_migrate)
+            imports = [measure_import(env) for _ in range(args.runs)]
+            label = f"{mode:5s} migrate={auto_migrate}"
+            print(f"{label} import main: median={statistics.median(s for s, _ in imports) * 1000:.0f}ms  loaded heavy modules=[{imports[-1][1]}]")
+            for workers in map(int, args.workers.split(",")):
+                timings = [measure_first_response(env, token, workers) for _ in range(args.runs)]
+                print(f"{label} workers={workers}: first response median={statistics.median(timings) * 1000:.0f}ms max={max(timings) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,151 @@
+"""同期版 (デフォルト) と ASYNC_DB=1 の async 版を同じ条件で負荷試験し、req/s とレイテンシを比較します。
+
+    cd backend
+    python benchmarks/load_test.py [--concurrency 64] [--duration 10] [--modes sync,async]
+
+DATABASE_URL が未設定なら一時的なSQLiteファイル (async版は aiosqlite) を使います。
+ローカルのPostgreSQLで試す場合は DATABASE_URL=postgresql://... を指定してください (asyncpg が必要)。
+各モードごとに uvicorn を別プロセスで起動し、httpx から並行にリクエストを送ります。
+ダッシュボードのキャッシュは無効にして、DBアクセスを含むコストを測ります。
+"""
+import argparse
+import asyncio
+import os
+import random
+import secrets
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/load.db")
+os.environ.setdefault("SECRET_KEY", secrets.token_hex(32)) # PostgreSQLに向けたときも起動できるように (uvicorn にも引き継ぐ)
+
+import main  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+
+def seed(n_categories, n_sites):
+    main.init_db()
+    db = main.SessionLocal()
+    try:
+        user = main.User(email=f"load-{time.time()}@example.com", google_id=f"load-{time.time()}")
+        db.add(user)
+        db.commit()
+        categories = []
+        for c in range(n_categories):
+            category = main.Category(name=f"category {c}", display_order=c, user_id=user.id)
+            db.add(category)
+            db.flush()
+            db.execute(insert(main.Site), [
+                {"title": f"site {c}-{s}", "url": f"https://example.com/{c}/{s}", "display_order": s, "category_id": category.id}
+                for s in range(n_sites)
+            ])
+            categories.append(category.id)
+        db.commit()
+        site_ids = {
+            category_id: [site_id for (site_id,) in db.query(main.Site.id).filter(main.Site.category_id == category_id).order_by(main.Site.display_order)]
+            for category_id in categories
+        }
+        return main.create_access_token(data={"sub": user.email, "user_id": user.id}), site_ids
+    finally:
+        db.close()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(mode, port, workers):
+    env = dict(os.environ, ASYNC_DB="1" if mode == "async" else "0", DASHBOARD_CACHE_SIZE="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(base_url, timeout=20):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(f"{base_url}/docs")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def run_load(base_url, token, site_ids, concurrency, duration):
+    headers = {"Authorization": f"Bearer {token}"}
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async def worker(client):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            # 読み込み中心のリクエスト構成 (ダッシュボード表示 : 認証確認 : 並び替え = 6 : 3 : 1)
+            roll = random.random()
+            start = time.perf_counter()
+            if roll < 0.6:
+                response = await client.get("/api/categories")
+            elif roll < 0.9:
+                response = await client.get("/api/users/me")
+            else:
+                category_id, ids = random.choice(list(site_ids.items()))
+                shuffled = random.sample(ids, len(ids))
+                response = await client.post("/api/layout", json={"sites": [{"id": i, "order": n} for n, i in enumerate(shuffled)]})
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30) as client:
+        started = time.monotonic()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "req/s": len(latencies) / elapsed,
+        "p50 ms": statistics.median(latencies),
+        "p99 ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "errors": errors,
+    }
+
+
+def main_():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--sites", type=int, default=50)
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    token, site_ids = seed(args.categories, args.sites)
+    print(f"{os.environ['DATABASE_URL']}  concurrency={args.concurrency} duration={args.duration}s workers={args.workers}")
+    for mode in args.modes.split(","):
+        port = free_port()
+        server = start_server(mode, port, args.workers)
+        try:
+            base_url = f"http://127.0.0.1:{port}"
+            asyncio.run(wait_ready(base_url))
+            result = asyncio.run(run_load(base_url, token, site_ids, args.concurrency, args.duration))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{mode:6s} " + "  ".join(f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}" for k, v in result.items()))
+
+
+if __name__ == "__main__":
+    main_()
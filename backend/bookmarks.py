@@ -0,0 +1,195 @@
+import codecs
+import html
+import json
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import AsyncIterator, List, Optional
+
+# --- ブックマークのインポート/エクスポート形式 ---
+# Netscape形式のHTML (ブラウザのエクスポート) と NDJSON (1行1件のJSON) を扱います。
+# どちらも受け取ったチャンクから少しずつ解析し、ファイル全体をメモリに載せません。
+
+DEFAULT_CATEGORY = "インポート"
+IMPORTABLE_SCHEMES = ("http://", "https://") # javascript: や place: などのブックマークは取り込まない
+
+
+def is_importable_url(url: Optional[str]) -> bool:
+    return bool(url) and url.startswith(IMPORTABLE_SCHEMES)
+
+
+@dataclass
+class BookmarkItem:
+    category: str
+    url: Optional[str] = None # None ならカテゴリだけを作る
+    title: Optional[str] = None
+
+
+class NetscapeBookmarkParser(HTMLParser):
+    """<H3> をフォルダ (=カテゴリ)、<A HREF> をサイトとして取り出します。入れ子のフォルダは一番内側の名前を使います。"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._folders: List[Optional[str]] = []
+        self._pending_folder: Optional[str] = None
+        self._text: Optional[list] = None
+        self._href: Optional[str] = None
+        self._items: List[BookmarkItem] = []
+
+    @property
+    def _category(self) -> str:
+        for name in reversed(self._folders):
+            if name:
+                return name
+        return DEFAULT_CATEGORY
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "h3":
+            self._text = []
+        elif tag == "a":
+            self._href = dict(attrs).get("href")
+            self._text = []
+        elif tag == "dl":
+            self._folders.append(self._pending_folder)
+            self._pending_folder = None
+
+    def handle_endtag(self, tag):
+        if tag == "h3" and self._text is not None:
+            self._pending_folder = "".join(self._text).strip() or None
+            self._text = None
+            if self._pending_folder:
+                self._items.append(BookmarkItem(category=self._pending_folder))
+        elif tag == "a" and self._text is not None:
+            if is_importable_url(self._href):
+                self._items.append(BookmarkItem(category=self._category, url=self._href, title="".join(self._text).strip() or None))
+            self._href = None
+            self._text = None
+        elif tag == "dl" and self._folders:
+            self._folders.pop()
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+    def feed_text(self, text: str) -> List[BookmarkItem]:
+        self.feed(text)
+        items, self._items = self._items, []
+        return items
+
+    def finish(self) -> List[BookmarkItem]:
+        self.close()
+        items, self._items = self._items, []
+        return items
+
+
+class NdjsonBookmarkParser:
+    """1行に {"category": ..., "url": ..., "title": ...} を1件ずつ持つNDJSONを解析します。
+    形式が正しくない行は ValueError (エンドポイントでは400) にします。取り込めないURLはHTMLと同じく読み飛ばし、カテゴリだけを作ります。"""
+
+    FIELDS = ("category", "url", "title")
+
+    def __init__(self):
+        self._buffer = ""
+        self._line_number = 0
+
+    def _parse_line(self, line: str) -> Optional[BookmarkItem]:
+        self._line_number += 1
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            raise ValueError(f"line {self._line_number}: {exc}") from exc
+        if not isinstance(data, dict):
+            raise ValueError(f"line {self._line_number}: expected a JSON object")
+        for field in self.FIELDS:
+            if data.get(field) is not None and not isinstance(data[field], str):
+                raise ValueError(f"line {self._line_number}: {field!r} must be a string")
+        category = data.get("category") or DEFAULT_CATEGORY
+        if not is_importable_url(data.get("url")):
+            return BookmarkItem(category=category)
+        return BookmarkItem(category=category, url=data["url"], title=data.get("title") or None)
+
+    def feed_text(self, text: str) -> List[BookmarkItem]:
+        self._buffer += text
+        *lines, self._buffer = self._buffer.split("\n")
+        return [item for item in map(self._parse_line, lines) if item is not None]
+
+    def finish(self) -> List[BookmarkItem]:
+        item = self._parse_line(self._buffer)
+        self._buffer = ""
+        return [item] if item else []
+
+
+def detect_format(content_type: Optional[str], first_chunk: bytes) -> str:
+    content_type = (content_type or "").lower()
+    if "html" in content_type:
+        return "html"
+    if "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+        return "ndjson"
+    return "html" if first_chunk.lstrip()[:1] == b"<" else "ndjson"
+
+
+async def parse_stream(chunks, fmt: str) -> AsyncIterator[BookmarkItem]:
+    """バイト列のチャンクを受け取りながら BookmarkItem を順に返します。"""
+    parser = NetscapeBookmarkParser() if fmt == "html" else NdjsonBookmarkParser()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for chunk in chunks:
+        for item in parser.feed_text(decoder.decode(chunk)):
+            yield item
+    for item in parser.feed_text(decoder.decode(b"", final=True)) + parser.finish():
+        yield item
+
+
+class NdjsonExporter:
+    """(category_id, category_name, title, url) の行を1行ずつNDJSONにします。サイトのないカテゴリは category だけの行になります。"""
+
+    media_type = "application/x-ndjson"
+    extension = "ndjson"
+
+    def start(self) -> str:
+        return ""
+
+    def row(self, category_id, category, title, url) -> str:
+        record = {"category": category}
+        if url is not None:
+            record.update(title=title, url=url)
+        return json.dumps(record, ensure_ascii=False) + "\n"
+
+    def end(self) -> str:
+        return ""
+
+
+class HtmlExporter:
+    """同じ行からNetscape形式のHTMLを組み立てます。行はカテゴリ順に並んでいる必要があります。"""
+
+    media_type = "text/html"
+    extension = "html"
+
+    def __init__(self):
+        self._current = None
+
+    def start(self) -> str:
+        return (
+            "<!DOCTYPE NETSCAPE-Bookmark-file-1>\n"
+            '<META HTTP-EQUIV="Content-Type" CONTENT="text/html; charset=UTF-8">\n'
+            "<TITLE>Bookmarks</TITLE>\n<H1>Bookmarks</H1>\n<DL><p>\n"
+        )
+
+    def row(self, category_id, category, title, url) -> str:
+        out = ""
+        if category_id != self._current:
+            if self._current is not None:
+                out += "    </DL><p>\n"
+            out += f"    <DT><H3>{html.escape(category)}</H3>\n    <DL><p>\n"
+            self._current = category_id
+        if url is not None:
+            out += f'        <DT><A HREF="{html.escape(url)}">{html.escape(title or url)}</A>\n'
+        return out
+
+    def end(self) -> str:
+        return ("    </DL><p>\n" if self._current is not None else "") + "</DL><p>\n"
+
+
+EXPORTERS = {"ndjson": NdjsonExporter, "html": HtmlExporter}
+EXPORT_CHUNK_SIZE = 64 * 1024 # この程度まとめてから送り出す
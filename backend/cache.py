@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+# --- プロセス内キャッシュ ---
+# 同期エンドポイントはスレッドプール上で並行に動くため、ロックで保護したLRUにしています。
+_MISSING = object()
+
+
+class LRUCache:
+    """件数上限付きのLRUキャッシュ。ttl(秒)を指定するとエントリに有効期限が付きます。"""
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else 0.0
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[1]
+
+    def configure(self, maxsize: int, ttl: Optional[float] = None) -> None:
+        """上限とTTLを変更します。上限を超えた分は古いものから捨てます。"""
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、もう一度実行せずにその結果を待ちます。
+
+    キャッシュが無効になった直後に同じユーザーの検索が重なると、それぞれが同じインデックスを
+    作り直してしまうのを防ぎます。スレッド (同期エンドポイント) とイベントループ (非同期API) の
+    どちらから待っても同じ実行を共有します。"""
+
+    def __init__(self):
+        self._calls: "dict[Hashable, Future]" = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """(実行中の Future, 自分が実行するか)。"""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._calls[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._finish(key, future, error=exc)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as exc:
+            self._finish(key, future, error=exc)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,169 @@
+import base64
+import logging
+import re
+import threading
+import time
+from typing import Callable, Dict, Optional, Protocol, Tuple
+
+from metrics import observe_outbound
+
+# requests / rsa / google-auth は読み込みが重いので、初めて使うときにインポートします (起動時間の短縮)
+
+# --- Google IDトークン検証用の公開鍵ストア ---
+# 公開鍵を一度取得してメモリに保持し、Cache-Control の max-age に従って更新します。
+# 更新はバックグラウンドで行うため、ログイン時の検証はネットワークなしで完結します。
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class CertSource(Protocol):
+    def fetch(self) -> Tuple[Dict[str, str], Optional[float]]:
+        """(key id -> PEM形式の証明書/公開鍵, 有効期間[秒] or None) を返します。"""
+        ...
+
+
+def _b64_int(value: str) -> int:
+    return int.from_bytes(base64.urlsafe_b64decode(value + "=" * (-len(value) % 4)), "big")
+
+
+def parse_certs(data: dict) -> Dict[str, str]:
+    """v1形式 ({kid: PEM}) とJWKS形式 ({"keys": [...]}) のどちらも {kid: PEM} にそろえます。"""
+    if "keys" not in data:
+        return dict(data)
+    certs = {}
+    for key in data["keys"]:
+        if key.get("kty") != "RSA" or key.get("use", "sig") != "sig":
+            continue
+        import rsa
+
+        public_key = rsa.PublicKey(_b64_int(key["n"]), _b64_int(key["e"]))
+        certs[key["kid"]] = public_key.save_pkcs1(format="PEM").decode("ascii")
+    return certs
+
+
+def parse_max_age(cache_control: Optional[str]) -> Optional[float]:
+    match = _MAX_AGE.search(cache_control or "")
+    return float(match.group(1)) if match else None
+
+
+class HttpCertSource:
+    """HTTPで公開鍵を取得します。url を差し替えればローカルのJWKSサーバーでも動きます。"""
+
+    def __init__(self, url: str = GOOGLE_CERTS_URL, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+        return self._session
+
+    def fetch(self) -> Tuple[Dict[str, str], Optional[float]]:
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+        finally:
+            observe_outbound("google_certs", time.perf_counter() - start)
+        response.raise_for_status()
+        return parse_certs(response.json()), parse_max_age(response.headers.get("Cache-Control"))
+
+
+class StaticCertSource:
+    """固定の鍵を返すソース。生成した鍵でのテストやオフライン環境用です。"""
+
+    def __init__(self, data: dict, max_age: Optional[float] = None):
+        self.certs = parse_certs(data)
+        self.max_age = max_age
+
+    def fetch(self) -> Tuple[Dict[str, str], Optional[float]]:
+        return self.certs, self.max_age
+
+
+class GoogleCertStore:
+    def __init__(
+        self,
+        source: CertSource,
+        default_max_age: float = 60 * 60,
+        refresh_ratio: float = 0.8,
+        min_refresh_interval: float = 30,
+        clock_skew: int = 10,
+    ):
+        self.source = source
+        self.default_max_age = default_max_age
+        self.refresh_ratio = refresh_ratio
+        self.min_refresh_interval = min_refresh_interval
+        self.clock_skew = clock_skew
+        self._certs: Dict[str, str] = {}
+        self._refresh_at = 0.0 # これを過ぎたらバックグラウンドで更新
+        self._expires_at = 0.0 # これを過ぎたら同期的に更新
+        self._last_attempt = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def refresh(self, if_needed: Optional[Callable[[], bool]] = None) -> Dict[str, str]:
+        """公開鍵を取り直します。if_needed はロックを取ってから確かめるので、同時に期限切れに気付いた
+        スレッドが順番に取り直すことはありません (先に取得したスレッドの鍵を返します)。"""
+        with self._lock:
+            if if_needed is not None and self._certs and not if_needed():
+                return self._certs
+            self._last_attempt = time.monotonic()
+            try:
+                certs, max_age = self.source.fetch()
+            except Exception:
+                # 取得に失敗しても手元の鍵があれば使い続ける
+                if not self._certs:
+                    raise
+                logger.warning("Failed to refresh Google certs; keeping the cached keys", exc_info=True)
+                return self._certs
+            max_age = max_age if max_age is not None else self.default_max_age
+            now = time.monotonic()
+            self._certs = certs
+            self._refresh_at = now + max_age * self.refresh_ratio
+            self._expires_at = now + max_age
+            return certs
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.warning("Background refresh of Google certs failed", exc_info=True)
+        finally:
+            self._refreshing = False
+
+    def _expired(self) -> bool:
+        return time.monotonic() >= self._expires_at
+
+    def get_certs(self) -> Dict[str, str]:
+        now = time.monotonic()
+        if not self._certs or now >= self._expires_at:
+            return self.refresh(self._expired)
+        if now >= self._refresh_at and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self._certs
+
+    def _can_refresh_for(self, kid: str) -> bool:
+        return kid not in self._certs and time.monotonic() - self._last_attempt >= self.min_refresh_interval
+
+    def verify(self, token: str, audience: Optional[str]) -> dict:
+        """IDトークンを検証して中身を返します。不正なトークンは ValueError になります。"""
+        from google.auth import jwt as google_jwt
+
+        certs = self.get_certs()
+        kid = google_jwt.decode_header(token).get("kid")
+        # 鍵のローテーション直後は未知のkidが来るので、間隔を空けて取り直す
+        if kid and kid not in certs and self._can_refresh_for(kid):
+            certs = self.refresh(lambda: self._can_refresh_for(kid))
+        idinfo = google_jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=self.clock_skew)
+        if idinfo.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer: {idinfo.get('iss')}")
+        return idinfo
@@ -1,44 +1,106 @@
-import requests
-from fastapi import FastAPI, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, BackgroundTasks, Response, Header, Request, Query
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 # ↓↓↓ declarative_baseのインポート元を修正 ↓↓↓
 from sqlalchemy.orm import Session, relationship, declarative_base 
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Index, select, update, insert, delete, event, values, column, bindparam, func, or_, literal, literal_column, cast, false, DDL
 # ↑↑↑ `sqlalchemy.ext.declarative` から削除 ↑↑↑
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects.postgresql import to_tsvector, to_tsquery # func.to_tsvector だと全文検索用の型が付かずコンパイルできない
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from dataclasses import dataclass
+import asyncio
+import hashlib
+import json
+import logging
+import time
 import secrets # SECRET_KEYを生成するために追加
 
 # --- 認証関連のライブラリ ---
 from datetime import datetime, timedelta, timezone
-from jose import JWTError, jwt
 from fastapi.security import OAuth2PasswordBearer
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-
-# --- 1. データベース接続設定 ---
-DB_USER = "s2422051"
-DB_PASSWORD = "mysecretpassword"
-DB_HOST = "localhost"
-DB_NAME = "s2422051"
-DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
-
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from google_certs import GoogleCertStore, HttpCertSource, GOOGLE_CERTS_URL
+# jose (JWT) は読み込みが重いので、トークンを扱う関数の中でインポートします (起動時間の短縮)
+
+from cache import LRUCache, SingleFlight
+from metadata_fetcher import fetcher, PageMetadata, TITLE_PLACEHOLDER, TITLE_FAILED
+from bookmarks import BookmarkItem, EXPORTERS, EXPORT_CHUNK_SIZE, detect_format, parse_stream
+from search_index import PrefixIndex, tokenize
+from metrics import MetricsMiddleware, registry, instrument_engine, timed_pool_class, timed, register_cache, register_pool
+from settings import Settings
+from migrations import migration, run_migrations
+
+# --- 1. 設定とデータベース接続 ---
+# 設定は環境変数から読み込みます (settings.py)。create_app(Settings(...)) で差し替えることもできます。
+# エンジンは最初にセッションを作るとき (get_engine) に作ります。`import main` や create_app では
+# DBのドライバを読み込まないので、ドライバの無い環境でもインポートでき、起動も速くなります。
+# async版 (settings.async_db) では同期用のエンジンとドライバは読み込みません。
+settings = Settings.from_env()
+logger = logging.getLogger("dashboard")
+
+def get_settings() -> Settings:
+    return settings
+
+def engine_options(url: str, pool_class=QueuePool) -> dict:
+    options = {"pool_pre_ping": settings.db_pool_pre_ping, "query_cache_size": settings.db_query_cache_size}
+    if make_url(url).get_backend_name() != "sqlite": # SQLiteのプールはサイズ指定を受け付けない
+        options.update(pool_size=settings.db_pool_size, max_overflow=settings.db_max_overflow, poolclass=timed_pool_class(pool_class)) # 取得待ち時間を記録するプール
+    return options
+
+class _LazySessionmaker(sessionmaker):
+    """bind が無ければ、最初のセッションを作るときにエンジンを作ります。"""
+
+    def __call__(self, **local_kw):
+        if "bind" not in local_kw and self.kw.get("bind") is None:
+            get_engine()
+        return super().__call__(**local_kw)
+
+engine = None
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base() # これで警告が出なくなります
 
+def configure_database():
+    """settings.database_url の同期用エンジンを作り、SessionLocal をそこに向けます。"""
+    global engine
+    if engine is not None:
+        engine.dispose()
+    engine = create_engine(settings.database_url, **engine_options(settings.database_url))
+    instrument_engine(engine)
+    register_pool("sync", engine.pool)
+    SessionLocal.configure(bind=engine)
+
+def get_engine():
+    if engine is None:
+        configure_database()
+    return engine
+
+def upgrade_schema(conn) -> List[str]:
+    """テーブルを作成し、既存のテーブルには足りない列とインデックスを追加します (migrations.py)。"""
+    return run_migrations(conn, Base.metadata)
+
+def init_db(bind=None) -> List[str]:
+    """`python main.py migrate` または DB_AUTO_MIGRATE=1 で実行されます。1トランザクションで行い、変更内容を返します。"""
+    with (bind or get_engine()).begin() as conn:
+        return upgrade_schema(conn)
+
 # --- 認証関連のグローバル設定 ---
-# ↓↓↓ 【重要】セキュリティのため、ランダムな文字列に変更してください ↓↓↓
-# 下のコマンドをターミナルで実行して生成した文字列に置き換えるのがオススメです
-# python -c 'import secrets; print(secrets.token_hex(32))'
-SECRET_KEY = "your-super-secret-key-that-you-should-change"
+# SECRET_KEY / GOOGLE_CLIENT_ID は環境変数で設定してください (settings.py)
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # トークン有効期限を7日間に設定
-# ↓↓↓ 【重要】必ずご自身のクライアントIDに書き換えてください！ ↓↓↓
-GOOGLE_CLIENT_ID = "836421431313-gvb58qo9abkiu7lbiuqpqfqe9egte9j3.apps.googleusercontent.com"
+# Googleの公開鍵はメモリに保持し、max-ageに従ってバックグラウンドで更新する (初回のログイン時に作成)
+_google_cert_store: Optional[GoogleCertStore] = None
+
+def get_google_cert_store() -> GoogleCertStore:
+    global _google_cert_store
+    if _google_cert_store is None:
+        _google_cert_store = GoogleCertStore(HttpCertSource(settings.google_certs_url or GOOGLE_CERTS_URL))
+    return _google_cert_store
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/google")
 
@@ -48,6 +110,8 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
     google_id = Column(String, unique=True, index=True)
+    board_version = Column(Integer, nullable=False, default=0, server_default="0") # ダッシュボードを変更するたびに+1
+    tombstones_pruned_seq = Column(Integer, nullable=False, default=0, server_default="0") # 削除済みの tombstones の change_seq の最大値
     categories = relationship("Category", back_populates="owner", cascade="all, delete-orphan")
 
 class Category(Base):
@@ -58,16 +122,95 @@ class Category(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="categories")
     sites = relationship("Site", back_populates="category", cascade="all, delete-orphan", order_by="Site.display_order")
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0") # 最後に変更されたときの board_version
+    __table_args__ = (
+        Index("ix_categories_user_id_display_order", "user_id", "display_order"),
+        Index("ix_categories_user_id_change_seq", "user_id", "change_seq"),
+    )
+
+def site_search_document(title, url):
+    """全文検索用の tsvector 式。インデックスと検索クエリで同じ式を使わないとインデックスが効きません。"""
+    simple = literal_column("'simple'::regconfig")
+    return to_tsvector(simple, func.coalesce(title, literal_column("''")).op("||")(literal_column("' '")).op("||")(func.coalesce(url, literal_column("''"))))
 
 class Site(Base):
     __tablename__ = "sites"
     id = Column(Integer, primary_key=True, index=True)
-    title = Column(String, index=True)
-    url = Column(String, index=True)
+    title = Column(String) # 部分一致検索は下のGINインデックス (PostgreSQLのみ) で行う
+    url = Column(String)
     favicon_url = Column(String, nullable=True)
+    description = Column(String, nullable=True)
     display_order = Column(Integer, default=0)
     category_id = Column(Integer, ForeignKey("categories.id"))
     category = relationship("Category", back_populates="sites")
+    change_seq = Column(Integer, nullable=False, default=0, server_default="0") # 最後に変更されたときの board_version
+    __table_args__ = (
+        Index("ix_sites_category_id_display_order", "category_id", "display_order"),
+        Index("ix_sites_category_id_change_seq", "category_id", "change_seq"),
+        Index("ix_sites_search_tsv", site_search_document(title, url), postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_sites_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+        Index("ix_sites_url_trgm", "url", postgresql_using="gin", postgresql_ops={"url": "gin_trgm_ops"}).ddl_if(dialect="postgresql"),
+    )
+
+class Tombstone(Base):
+    """削除したカテゴリ/サイトの記録。差分同期 (/api/changes) で削除をクライアントへ伝えるために使います。"""
+    __tablename__ = "tombstones"
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    kind = Column(String, nullable=False) # "category" または "site"
+    object_id = Column(Integer, nullable=False)
+    change_seq = Column(Integer, nullable=False)
+    deleted_at = Column(Integer, nullable=False, default=lambda: int(time.time()), server_default="0") # UNIX時間。保持期間を過ぎたら削除する
+    __table_args__ = (Index("ix_tombstones_user_id_change_seq", "user_id", "change_seq"),)
+
+class RevokedToken(Base):
+    """失効させたトークン。全ワーカーで共有するためDBに置きます。トークン自体ではなくハッシュを保存します。"""
+    __tablename__ = "revoked_tokens"
+    token_hash = Column(String(64), primary_key=True) # SHA-256 (16進)
+    expires_at = Column(Integer, nullable=False, index=True) # トークンの exp (UNIX時間)。過ぎたら削除してよい
+
+# トライグラムのインデックスには pg_trgm 拡張が必要
+event.listen(Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+# --- 既存のDBへのスキーマ変更 (migrations.py)。新しく作ったDBでは何もしない ---
+def _model_index(model, name: str) -> Index:
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+@migration("sites.description")
+def _add_site_description(m):
+    m.add_column(Site.__table__.c.description)
+
+@migration("display_order indexes")
+def _add_display_order_indexes(m):
+    m.create_index(_model_index(Category, "ix_categories_user_id_display_order"))
+    m.create_index(_model_index(Site, "ix_sites_category_id_display_order"))
+
+@migration("users.board_version")
+def _add_board_version(m):
+    m.add_column(User.__table__.c.board_version) # 既存の行は server_default の 0 から始まる
+
+@migration("sites search indexes")
+def _add_search_indexes(m):
+    # PostgreSQLのみ。GINインデックスの作成中は sites への書き込みが待たされる (10万件で数秒程度)
+    m.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm", dialect="postgresql")
+    for name in ("ix_sites_search_tsv", "ix_sites_title_trgm", "ix_sites_url_trgm"):
+        m.create_index(_model_index(Site, name))
+    # 以前 title/url に付けていたB-treeインデックスは部分一致検索に使えないので削除する
+    m.drop_index("sites", "ix_sites_title")
+    m.drop_index("sites", "ix_sites_url")
+
+@migration("change_seq")
+def _add_change_seq(m):
+    # 既存の行は 0 (差分同期を始める前からあったもの)。since=0 の全件取得で届く
+    m.add_column(Category.__table__.c.change_seq)
+    m.add_column(Site.__table__.c.change_seq)
+    m.create_index(_model_index(Category, "ix_categories_user_id_change_seq"))
+    m.create_index(_model_index(Site, "ix_sites_category_id_change_seq"))
+
+@migration("tombstone retention")
+def _add_tombstone_retention(m):
+    m.add_column(Tombstone.__table__.c.deleted_at) # 既存の行は 0 なので、次に削除するときに掃除される
+    m.add_column(User.__table__.c.tombstones_pruned_seq)
 
 # --- 3. Pydanticスキーマ定義 (ユーザー関連を追加) ---
 class Token(BaseModel):
@@ -93,6 +236,7 @@ class SiteUpdate(BaseModel):
 class SiteResponse(SiteBase):
     id: int
     favicon_url: Optional[str] = None
+    description: Optional[str] = None
     display_order: int
     class Config:
         from_attributes = True
@@ -114,15 +258,64 @@ class OrderUpdateRequest(BaseModel):
 class MoveSiteRequest(BaseModel):
     site_id: int
     new_category_id: int
+class LayoutSite(OrderUpdateRequest):
+    category_id: Optional[int] = None # 指定するとそのカテゴリへ移動
+class LayoutRequest(BaseModel):
+    categories: List[OrderUpdateRequest] = []
+    sites: List[LayoutSite] = []
+class LayoutResponse(BaseModel):
+    board_version: int
+class SearchHit(BaseModel):
+    id: int
+    title: Optional[str] = None
+    url: str
+    favicon_url: Optional[str] = None
+    description: Optional[str] = None
+    display_order: int
+    category_id: int
+    category_name: str
+    score: float
+class SearchResponse(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+class CategorySummary(BaseModel):
+    id: int
+    name: str
+    display_order: int
+class SiteChange(SiteResponse):
+    category_id: int
+class ChangesResponse(BaseModel):
+    version: int
+    full: bool # true なら手元のデータを破棄して置き換える
+    categories: List[CategorySummary]
+    sites: List[SiteChange]
+    deleted_categories: List[int]
+    deleted_sites: List[int]
+class ImportResponse(BaseModel):
+    categories_created: int
+    sites_created: int
+    metadata_queued: int
+    board_version: int
 
-# --- 4. データベースのテーブル作成 ---
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI()
+# --- 4. アプリケーション ---
+# テーブル作成とスキーマ変更はインポート時には行わず、`python main.py migrate` (または DB_AUTO_MIGRATE=1 での起動時) に行います。
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for warning in settings.check_defaults(): # 開発用以外のDBで既定の SECRET_KEY なら起動しない
+        logger.warning(warning)
+    if settings.async_db:
+        import async_api
+        if settings.auto_migrate:
+            async with async_api.get_async_engine().begin() as conn:
+                await conn.run_sync(upgrade_schema)
+    elif settings.auto_migrate:
+        await run_in_threadpool(init_db)
+    yield
+    await fetcher.aclose() # 共有HTTPクライアントのコネクションを閉じる
+    if settings.async_db:
+        await async_api.dispose_async_engine()
 
-# --- CORS設定 ---
-origins = [ "http://localhost:5173", "chrome-extension://836421431313-gvb58qo9abkiu7lbiuqpqfqe9egte9j3.apps.googleusercontent.com" ] # 拡張機能からのアクセスを許可
-app.add_middleware(CORSMiddleware, allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+router = APIRouter() # settings.async_db のときは async_api.router を代わりに登録する
 
 def get_db():
     db = SessionLocal()
@@ -133,39 +326,134 @@ def get_db():
 
 # --- 認証関連のヘルパー関数 ---
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    from jose import jwt
+
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, settings.secret_key, algorithm=ALGORITHM)
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+# --- 認証キャッシュ ---
+# 検証済みトークン -> user_id と、user_id -> 最小限のユーザー情報をTTL付きでキャッシュし、
+# 認証のたびに jwt.decode とDB問い合わせを行わずに済むようにします。
+# トークンの失効は revoked_tokens テーブルで全ワーカーに共有し、トークンがキャッシュに無いときに確認します。
+# そのため、他のワーカーが失効したトークンを受け付けるのは最大 settings.token_cache_ttl 秒です。
+token_cache = LRUCache(maxsize=settings.auth_cache_size, ttl=settings.token_cache_ttl)
+user_cache = LRUCache(maxsize=settings.auth_cache_size, ttl=settings.auth_cache_ttl)
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """get_current_user が返す認証済みユーザー。エンドポイントが必要とする項目だけを持ちます。"""
+    id: int
+    email: str
+
+def invalidate_user(user_id: int):
+    """ユーザーの削除・変更時に呼び出します。以降の認証はDBから読み直されます。"""
+    user_cache.pop(user_id)
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def revocation_statement(dialect_name: str, token: str):
+    """失効の記録を追加する文 (既にあれば何もしない)。読み取れないトークンや期限切れのトークンはもともと受け付けないので None。"""
+    from jose import JWTError, jwt
+
+    try:
+        exp = int(jwt.get_unverified_claims(token).get("exp") or 0)
+    except JWTError:
+        return None
+    if exp <= time.time():
+        return None
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    return upsert(RevokedToken).values(token_hash=token_digest(token), expires_at=exp).on_conflict_do_nothing()
+
+def expired_revocations_delete():
+    return delete(RevokedToken).where(RevokedToken.expires_at <= int(time.time()))
+
+def revoked_token_query(token: str):
+    return select(RevokedToken.token_hash).where(RevokedToken.token_hash == token_digest(token))
+
+def revoke_token(db: Session, token: str):
+    """トークンを有効期限まで拒否します。呼び出し元と同じトランザクションでコミットされます。
+    このワーカーではすぐに、他のワーカーでもキャッシュが切れ次第 (最大 settings.token_cache_ttl 秒) 拒否されます。"""
+    token_cache.pop(token)
+    db.execute(expired_revocations_delete()) # 期限切れの記録はここで掃除する
+    stmt = revocation_statement(db.get_bind().dialect.name, token)
+    if stmt is not None:
+        db.execute(stmt)
+
+@event.listens_for(User, "after_delete")
+@event.listens_for(User, "after_update")
+def _invalidate_user_on_change(mapper, connection, target):
+    invalidate_user(target.id)
+
+def credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> Tuple[int, float]:
+    """トークンの署名と有効期限を検証して (user_id, exp) を返します。失効の確認は呼び出し元でDBに対して行います。"""
+    from jose import JWTError, jwt
+
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: int = payload.get("user_id")
-        if user_id is None:
-            raise credentials_exception
+        with timed("jwt_decode"):
+            payload = jwt.decode(token, settings.secret_key, algorithms=[ALGORITHM])
     except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
-        raise credentials_exception
-    return user
+        raise credentials_exception()
+    user_id: int = payload.get("user_id")
+    if user_id is None:
+        raise credentials_exception()
+    return user_id, payload.get("exp", 0)
+
+def cache_token(token: str, user_id: int, exp: float, revoked) -> int:
+    """revoked は revoked_token_query の結果の行 (失効していなければ None)。"""
+    if revoked is not None:
+        raise credentials_exception()
+    # トークンの有効期限を超えてキャッシュしない
+    remaining = exp - time.time()
+    if remaining > 0:
+        token_cache.set(token, user_id, ttl=min(settings.token_cache_ttl, remaining))
+    return user_id
+
+def user_identity_query(user_id: int):
+    return select(User.id, User.email).where(User.id == user_id)
+
+def cache_current_user(row) -> CurrentUser:
+    if row is None:
+        raise credentials_exception()
+    current_user = CurrentUser(id=row.id, email=row.email)
+    user_cache.set(row.id, current_user)
+    return current_user
+
+def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+    user_id = token_cache.get(token)
+    if user_id is None:
+        user_id, exp = decode_token(token)
+        user_id = cache_token(token, user_id, exp, db.execute(revoked_token_query(token)).first())
+    current_user = user_cache.get(user_id)
+    if current_user is None:
+        with timed("user_lookup"):
+            current_user = cache_current_user(db.execute(user_identity_query(user_id)).first())
+    return current_user
 
 # --- 5. APIエンドポイント (Google認証用を追加、既存APIを認証付きに修正) ---
-@app.post("/api/auth/google", response_model=Token)
+@router.post("/api/auth/google", response_model=Token)
 def google_login(request: GoogleLoginRequest, db: Session = Depends(get_db)):
-    if not GOOGLE_CLIENT_ID or "【" in GOOGLE_CLIENT_ID:
+    google_client_id = settings.google_client_id
+    if not google_client_id or "【" in google_client_id:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Google Client ID is not configured on the server",
         )
     try:
-        idinfo = id_token.verify_oauth2_token(request.token, google_requests.Request(), GOOGLE_CLIENT_ID)
+        with timed("google_verify"):
+            idinfo = get_google_cert_store().verify(request.token, google_client_id)
         google_id = idinfo['sub']
         email = idinfo['email']
     except ValueError:
@@ -185,113 +473,517 @@ def google_login(request: GoogleLoginRequest, db: Session = Depends(get_db)):
     access_token = create_access_token(data={"sub": user.email, "user_id": user.id}, expires_delta=access_token_expires)
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.get("/api/users/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(get_current_user)):
+@router.get("/api/users/me", response_model=UserResponse)
+def read_users_me(current_user: CurrentUser = Depends(get_current_user)):
     return current_user
 
 # (これ以降のエンドポイントは、セキュリティチェックが追加されているので、そのまま流用します)
 # ... (変更なし) ...
-@app.get("/api/categories", response_model=List[CategoryResponse])
-def read_categories(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return db.query(Category).filter(Category.user_id == current_user.id).order_by(Category.display_order).all()
+# --- ダッシュボード (カテゴリ+サイト一覧) の組み立て ---
+# ORMオブジェクトを経由せず、1回のJOINクエリの行から直接JSONを組み立てます。
+def dashboard_query(user_id: int):
+    return (
+        select(
+            Category.id, Category.name, Category.display_order,
+            Site.id, Site.url, Site.title, Site.favicon_url, Site.description, Site.display_order,
+        )
+        .outerjoin(Site, Site.category_id == Category.id)
+        .where(Category.user_id == user_id)
+        .order_by(Category.display_order, Category.id, Site.display_order, Site.id)
+    )
+
+def build_dashboard(rows) -> list:
+    categories = []
+    current = None
+    for cat_id, name, cat_order, site_id, url, title, favicon_url, description, site_order in rows:
+        if current is None or current["id"] != cat_id:
+            current = {"name": name, "id": cat_id, "display_order": cat_order, "sites": []}
+            categories.append(current)
+        if site_id is not None:
+            current["sites"].append({
+                "url": url, "title": title, "id": site_id, "favicon_url": favicon_url,
+                "description": description, "display_order": site_order,
+            })
+    return categories
+
+def dump_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+# --- ダッシュボードのキャッシュ ---
+# users.board_version を変更系エンドポイントで必ず+1し、(バージョン, JSON) をユーザー単位でキャッシュします。
+# バージョンはDBにあるので、複数ワーカーでも古いキャッシュを返すことはありません。
+dashboard_cache = LRUCache(maxsize=settings.dashboard_cache_size)
+
+def board_version_bump(user_id: int):
+    dashboard_cache.pop(user_id) # このプロセスのキャッシュは即座に破棄 (他ワーカーはバージョン比較で検出)
+    return update(User).where(User.id == user_id).values(board_version=User.board_version + 1).returning(User.board_version)
+
+def board_version_query(user_id: int):
+    return select(User.board_version).where(User.id == user_id)
+
+def changes_state_query(user_id: int):
+    return select(User.board_version, User.tombstones_pruned_seq).where(User.id == user_id)
+
+def bump_board_version(db: Session, user_id: int) -> int:
+    """ユーザーのボードのバージョンを+1します。呼び出し元と同じトランザクションでコミットされます。"""
+    return db.execute(board_version_bump(user_id)).scalar_one()
+
+def get_board_version(db: Session, user_id: int) -> int:
+    return db.execute(board_version_query(user_id)).scalar_one()
+
+def stamp_changed(rows, change_seq: int):
+    for row in rows:
+        row.change_seq = change_seq
+
+def tombstone(user_id: int, kind: str, object_id: int, change_seq: int) -> Tombstone:
+    return Tombstone(user_id=user_id, kind=kind, object_id=object_id, change_seq=change_seq)
+
+def category_sites_tombstones_insert(user_id: int, category_id: int, change_seq: int):
+    """カテゴリと一緒に消えるサイトの削除記録を1つの INSERT ... SELECT で追加します。サイトを削除する前に実行してください。
+    カテゴリの削除記録だけだと、同期後に別のカテゴリから移動してきたサイトがクライアントに残ってしまうため。"""
+    rows = select(
+        literal(user_id), literal("site"), Site.id, literal(change_seq), literal(int(time.time())),
+    ).where(Site.category_id == category_id)
+    return insert(Tombstone).from_select(["user_id", "kind", "object_id", "change_seq", "deleted_at"], rows)
+
+def expired_tombstones_query(user_id: int):
+    """保持期間 (settings.tombstone_retention_days) を過ぎた削除記録のうち、最新の change_seq。無ければ None。"""
+    cutoff = int(time.time() - settings.tombstone_retention_days * 24 * 60 * 60)
+    return select(func.max(Tombstone.change_seq)).where(Tombstone.user_id == user_id, Tombstone.deleted_at < cutoff)
+
+def prune_tombstones_statements(user_id: int, pruned_seq: int):
+    # change_seq は deleted_at と同じ順に増えるので、インデックスの効く change_seq で消す
+    return (
+        delete(Tombstone).where(Tombstone.user_id == user_id, Tombstone.change_seq <= pruned_seq),
+        update(User).where(User.id == user_id).values(tombstones_pruned_seq=pruned_seq),
+    )
+
+def prune_tombstones(db: Session, user_id: int):
+    """古い削除記録を消します。消した分は tombstones_pruned_seq に記録し、それより前の since には全件を返します。
+    削除のたびに呼び出し、呼び出し元と同じトランザクションでコミットされます。"""
+    pruned_seq = db.execute(expired_tombstones_query(user_id)).scalar()
+    if pruned_seq is not None:
+        for stmt in prune_tombstones_statements(user_id, pruned_seq):
+            db.execute(stmt)
+
+def needs_full_sync(since: int, version: int, pruned_seq: int) -> bool:
+    # since=0 は初回、未来の値は別のDBのもの。pruned_seq より前からの差分は削除記録が残っていないので作れない
+    return since == 0 or since > version or since < pruned_seq
+
+def make_etag(user_id: int, version: int) -> str:
+    return f'"{user_id}-{version}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match は弱い比較 (W/ を無視) で判定する
+    return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+@router.get("/api/categories", response_model=List[CategoryResponse])
+def read_categories(db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user), if_none_match: Optional[str] = Header(None)):
+    version = get_board_version(db, current_user.id)
+    etag = make_etag(current_user.id, version)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    cached = dashboard_cache.get(current_user.id)
+    if cached is not None and cached[0] == version:
+        body = cached[1]
+    else:
+        # response_model はドキュメント用。Responseを直接返すのでpydanticの検証/変換は通らない
+        rows = db.execute(dashboard_query(current_user.id)).all()
+        with timed("serialize"):
+            body = dump_json(build_dashboard(rows))
+        dashboard_cache.set(current_user.id, (version, body))
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# --- 差分同期 ---
+# 変更した行には、そのとき+1した board_version を change_seq として記録し、削除は tombstones に残します。
+# board_version の更新は users の行ロックで直列化されるので、バージョン v を読んだ時点で
+# change_seq <= v の変更はすべてコミット済みです。クライアントは返された version を次回の since に使います。
+def category_summary_query(user_id: int):
+    return select(Category.id, Category.name, Category.display_order).where(Category.user_id == user_id).order_by(Category.display_order, Category.id)
+
+def category_changes_query(user_id: int, since: int):
+    return select(Category.id, Category.name, Category.display_order).where(Category.user_id == user_id, Category.change_seq > since)
+
+def site_changes_query(user_id: int, since: int):
+    return (
+        select(Site.id, Site.url, Site.title, Site.favicon_url, Site.description, Site.display_order, Site.category_id)
+        .join(Category, Site.category_id == Category.id)
+        .where(Category.user_id == user_id, Site.change_seq > since)
+    )
+
+def tombstones_query(user_id: int, since: int):
+    return select(Tombstone.kind, Tombstone.object_id).where(Tombstone.user_id == user_id, Tombstone.change_seq > since)
+
+def build_changes(version: int, full: bool, categories, sites, tombstones) -> dict:
+    deleted = {"category": set(), "site": set()}
+    for kind, object_id in tombstones:
+        deleted[kind].add(object_id)
+    return {
+        "version": version,
+        "full": full,
+        "categories": [{"id": id_, "name": name, "display_order": order} for id_, name, order in categories],
+        "sites": [
+            {"url": url, "title": title, "id": id_, "favicon_url": favicon_url, "description": description, "display_order": order, "category_id": category_id}
+            for id_, url, title, favicon_url, description, order, category_id in sites
+        ],
+        "deleted_categories": sorted(deleted["category"]),
+        "deleted_sites": sorted(deleted["site"]),
+    }
+
+@router.get("/api/changes", response_model=ChangesResponse)
+def read_changes(since: int = Query(0, ge=0), db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    """since より後の変更だけを返します。since=0 (または未来の値、削除記録の保持期間より古い値) なら全件を返し、full=true になります。
+    クライアントは削除を先に、続けて categories/sites を上書きで反映してください。"""
+    version, pruned_seq = db.execute(changes_state_query(current_user.id)).one()
+    full = needs_full_sync(since, version, pruned_seq)
+    if full:
+        since = -1 # change_seq=0 (差分同期の導入前からある行) も含める
+    body = build_changes(
+        version, full,
+        db.execute(category_changes_query(current_user.id, since)).all(),
+        db.execute(site_changes_query(current_user.id, since)).all(),
+        [] if full else db.execute(tombstones_query(current_user.id, since)).all(),
+    )
+    return Response(content=dump_json(body), media_type="application/json", headers={"Cache-Control": "private, no-cache"})
+
+@router.get("/api/categories/names", response_model=List[CategorySummary])
+def read_category_names(db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    """サイトを含まないカテゴリ一覧 (拡張機能のプルダウン用)。"""
+    rows = db.execute(category_summary_query(current_user.id)).all()
+    return Response(content=dump_json([{"id": id_, "name": name, "display_order": order} for id_, name, order in rows]), media_type="application/json")
 
-@app.post("/api/categories", response_model=CategoryResponse)
-def create_category(category: CategoryCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.post("/api/categories", response_model=CategoryResponse)
+def create_category(category: CategoryCreate, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     max_order = db.query(Category).filter(Category.user_id == current_user.id).count()
     db_category = Category(name=category.name, display_order=max_order, user_id=current_user.id)
     db.add(db_category)
+    db_category.change_seq = bump_board_version(db, current_user.id)
     db.commit()
     db.refresh(db_category)
     return db_category
 
-@app.put("/api/categories/{category_id}", response_model=CategoryResponse)
-def update_category(category_id: int, category: CategoryUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.put("/api/categories/{category_id}", response_model=CategoryResponse)
+def update_category(category_id: int, category: CategoryUpdate, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_category = db.query(Category).filter(Category.id == category_id, Category.user_id == current_user.id).first()
     if db_category is None:
         raise HTTPException(status_code=404, detail="Category not found")
     db_category.name = category.name
+    db_category.change_seq = bump_board_version(db, current_user.id)
     db.commit()
     db.refresh(db_category)
     return db_category
 
-@app.delete("/api/categories/{category_id}", status_code=204)
-def delete_category(category_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/api/categories/{category_id}", status_code=204)
+def delete_category(category_id: int, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_category = db.query(Category).filter(Category.id == category_id, Category.user_id == current_user.id).first()
     if db_category is None:
         raise HTTPException(status_code=404, detail="Category not found")
+    change_seq = bump_board_version(db, current_user.id)
+    db.execute(category_sites_tombstones_insert(current_user.id, category_id, change_seq))
     db.delete(db_category)
+    db.add(tombstone(current_user.id, "category", category_id, change_seq))
+    prune_tombstones(db, current_user.id)
     db.commit()
     return
 
-@app.post("/api/sites", response_model=SiteResponse)
-def create_site(site: SiteCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+# --- サイトのタイトル/説明文をバックグラウンドで補完 ---
+def sites_with_owner_query(site_ids):
+    return select(Site, Category.user_id).join(Category, Site.category_id == Category.id).where(Site.id.in_(site_ids))
+
+def apply_site_metadata(db_site: Site, meta: PageMetadata) -> bool:
+    """取得結果を反映します。ユーザーが既にタイトルを編集していれば上書きしません。"""
+    changed = False
+    if db_site.title == TITLE_PLACEHOLDER:
+        db_site.title = meta.title or TITLE_FAILED
+        changed = True
+    if meta.description and not db_site.description:
+        db_site.description = meta.description
+        changed = True
+    return changed
+
+def save_site_metadata(results: dict):
+    db = SessionLocal()
+    try:
+        changed: dict = {} # user_id -> 変更したサイト
+        for db_site, user_id in db.execute(sites_with_owner_query(list(results))).all():
+            if apply_site_metadata(db_site, results[db_site.id]):
+                changed.setdefault(user_id, []).append(db_site)
+        for user_id, db_sites in changed.items():
+            stamp_changed(db_sites, bump_board_version(db, user_id))
+        db.commit()
+    finally:
+        db.close()
+
+async def fetch_site_metadata(sites: List[tuple]) -> dict:
+    """(site_id, url) のリストを受け取り、まとめて取得して {site_id: PageMetadata} を返します。"""
+    fetched = await fetcher.fetch_many(url for _, url in sites)
+    return {site_id: fetched.get(url, PageMetadata(title=None)) for site_id, url in sites}
+
+async def fill_site_metadata(sites: List[tuple]):
+    """取得が終わってから1回のDB書き込みで保存します。"""
+    await run_in_threadpool(save_site_metadata, await fetch_site_metadata(sites))
+
+def pending_metadata_query():
+    """仮タイトルのまま残っているサイト。取得前にプロセスが終了すると、誰も取得し直さないため。"""
+    return select(Site.id, Site.url).where(Site.title == TITLE_PLACEHOLDER).order_by(Site.id)
+
+def load_pending_metadata() -> List[tuple]:
+    db = SessionLocal()
+    try:
+        return [tuple(row) for row in db.execute(pending_metadata_query()).all()]
+    finally:
+        db.close()
+
+def requeue_site_metadata() -> int:
+    """仮タイトルのまま残っているサイトのタイトル取得をやり直し、件数を返します (`python main.py requeue-metadata`)。
+    sites 全体を検索するので、ワーカーの起動時ではなくデプロイ後などに1回だけ実行します。"""
+    sites = load_pending_metadata()
+
+    async def run():
+        try:
+            await queue_site_metadata(sites)
+        finally:
+            await fetcher.aclose()
+
+    if sites:
+        asyncio.run(run())
+    return len(sites)
+
+@router.post("/api/sites", response_model=SiteResponse)
+def create_site(site: SiteCreate, background_tasks: BackgroundTasks, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     category = db.query(Category).filter(Category.id == site.category_id, Category.user_id == current_user.id).first()
     if not category:
         raise HTTPException(status_code=404, detail="Category not found for this user")
-        
-    title = site.title
-    if not title:
-        try:
-            headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36'}
-            page = requests.get(site.url, timeout=5, headers=headers)
-            page.raise_for_status()
-            soup = BeautifulSoup(page.content, "html.parser")
-            title_tag = soup.find('title')
-            title = title_tag.get_text(strip=True) if title_tag else "タイトル取得失敗"
-        except requests.RequestException:
-            title = "タイトル取得失敗"
-    
+
+    # タイトルが未指定なら仮タイトルで先に登録し、取得はレスポンス返却後に行う
+    title = site.title or TITLE_PLACEHOLDER
     favicon_url = f"https://www.google.com/s2/favicons?domain={urlparse(site.url).netloc}&sz=32"
     max_order = db.query(Site).filter(Site.category_id == site.category_id).count()
     db_site = Site(title=title, url=site.url, category_id=site.category_id, favicon_url=favicon_url, display_order=max_order)
     db.add(db_site)
+    db_site.change_seq = bump_board_version(db, current_user.id)
     db.commit()
     db.refresh(db_site)
+    if title == TITLE_PLACEHOLDER:
+        background_tasks.add_task(fill_site_metadata, [(db_site.id, db_site.url)])
     return db_site
 
-@app.put("/api/sites/{site_id}", response_model=SiteResponse)
-def update_site_title(site_id: int, site_update: SiteUpdate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.put("/api/sites/{site_id}", response_model=SiteResponse)
+def update_site_title(site_id: int, site_update: SiteUpdate, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_site = db.query(Site).join(Category).filter(Site.id == site_id, Category.user_id == current_user.id).first()
     if not db_site:
         raise HTTPException(status_code=404, detail="Site not found")
     db_site.title = site_update.title
+    db_site.change_seq = bump_board_version(db, current_user.id)
     db.commit()
     db.refresh(db_site)
     return db_site
 
-@app.delete("/api/sites/{site_id}", status_code=204)
-def delete_site(site_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.delete("/api/sites/{site_id}", status_code=204)
+def delete_site(site_id: int, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     db_site = db.query(Site).join(Category).filter(Site.id == site_id, Category.user_id == current_user.id).first()
     if db_site is None:
         raise HTTPException(status_code=404, detail="Site not found")
     db.delete(db_site)
+    db.add(tombstone(current_user.id, "site", site_id, bump_board_version(db, current_user.id)))
+    prune_tombstones(db, current_user.id)
     db.commit()
     return
 
-@app.post("/api/update-order/categories")
-def update_categories_order(order_updates: List[OrderUpdateRequest], db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    for update in order_updates:
-        db.query(Category).filter(Category.id == update.id, Category.user_id == current_user.id).update({"display_order": update.order})
+# --- サイト検索 ---
+# PostgreSQLでは tsvector の前方一致とトライグラムの部分一致 (どちらもGINインデックス) で検索し、
+# それ以外のDBではユーザーごとのメモリ内前方一致インデックスを使います。
+search_index_cache = LRUCache(maxsize=settings.search_index_cache_size)
+search_index_builds = SingleFlight() # (user_id, board_version) -> 構築中のインデックス
+SEARCH_COLUMNS = (
+    Site.id, Site.title, Site.url, Site.favicon_url, Site.description, Site.display_order, Category.id, Category.name,
+)
+
+# トライグラムは3文字単位なので、それより短い語の部分一致 (ILIKE '%q%') はインデックスが効かず全件を走査する。
+# 短い語は tsvector の前方一致だけで検索する
+TRGM_MIN_LENGTH = 3
+
+def _like_pattern(q: str) -> str:
+    return "%" + q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def pg_search_query(user_id: int, q: str, limit: int, offset: int):
+    """1件多く取得して、次のページがあるかを判定します。"""
+    document = site_search_document(Site.title, Site.url)
+    terms = tokenize(q)
+    conditions, ranks = [], []
+    if len(q.strip()) >= TRGM_MIN_LENGTH:
+        pattern = _like_pattern(q.strip())
+        conditions += [Site.title.ilike(pattern, escape="\\"), Site.url.ilike(pattern, escape="\\")]
+        ranks.append(func.similarity(Site.title, q))
+    if terms:
+        tsquery = to_tsquery(literal_column("'simple'::regconfig"), " & ".join(f"{term}:*" for term in terms))
+        conditions.append(document.op("@@")(tsquery))
+        ranks.append(func.ts_rank(document, tsquery))
+    rank = func.greatest(*ranks) if len(ranks) > 1 else ranks[0] if ranks else literal(0.0)
+    return (
+        select(*SEARCH_COLUMNS, rank.label("score"))
+        .join(Category, Site.category_id == Category.id)
+        .where(Category.user_id == user_id, or_(false(), *conditions)) # 条件が無ければ0件
+        .order_by(rank.desc(), Site.id)
+        .limit(limit + 1)
+        .offset(offset)
+    )
+
+def search_rows_query(user_id: int):
+    return select(*SEARCH_COLUMNS).join(Category, Site.category_id == Category.id).where(Category.user_id == user_id)
+
+def cached_search_index(user_id: int, version: int) -> Optional[PrefixIndex]:
+    cached = search_index_cache.get(user_id)
+    return cached[1] if cached is not None and cached[0] == version else None
+
+def search_response(scored_rows, limit: int, offset: int) -> dict:
+    """scored_rows は (score, (site_id, title, url, favicon_url, description, display_order, category_id, category_name))。"""
+    results = [
+        {
+            "id": row[0], "title": row[1], "url": row[2], "favicon_url": row[3], "description": row[4],
+            "display_order": row[5], "category_id": row[6], "category_name": row[7], "score": score,
+        }
+        for score, row in scored_rows[:limit]
+    ]
+    return {"results": results, "next_offset": offset + limit if len(scored_rows) > limit else None}
+
+@router.get("/api/sites/search", response_model=SearchResponse)
+def search_sites(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user),
+):
+    if db.get_bind().dialect.name == "postgresql":
+        rows = db.execute(pg_search_query(current_user.id, q, limit, offset)).all()
+        return search_response([(float(row[-1]), row[:-1]) for row in rows], limit, offset)
+
+    version = get_board_version(db, current_user.id)
+
+    def build() -> PrefixIndex:
+        index = cached_search_index(current_user.id, version) # 待っている間に別のリクエストが作り終えていれば使う
+        if index is None:
+            index = PrefixIndex(db.execute(search_rows_query(current_user.id)).all())
+            search_index_cache.set(current_user.id, (version, index))
+        return index
+
+    index = cached_search_index(current_user.id, version)
+    if index is None:
+        index = search_index_builds.do((current_user.id, version), build) # 同時に来た検索は1回の構築を待つ
+    return search_response(index.search(q, limit + 1, offset), limit, offset)
+
+# --- 並び順の一括更新 ---
+# 1行ずつUPDATEせず、PostgreSQLでは UPDATE ... FROM (VALUES ...) の1文で、
+# それ以外のDBでは executemany で更新します。所有者のチェックも同じ文の中で行います。
+LAYOUT_CHUNK_SIZE = 5000 # PostgreSQLのバインドパラメータ上限(65535)を超えないように分割
+
+def _unique_by_id(items) -> list:
+    return list({item.id: item for item in items}.values())
+
+def category_order_statement(dialect_name: str, user_id: int, items, change_seq: int):
+    """items は (id, order) のリスト。(文, executemany用パラメータ or None) を返します。"""
+    categories = Category.__table__
+    if dialect_name == "postgresql":
+        v = values(column("id", Integer), column("display_order", Integer), name="v").data(items)
+        stmt = (
+            update(categories)
+            .where(categories.c.id == v.c.id, categories.c.user_id == user_id)
+            .values(display_order=v.c.display_order, change_seq=change_seq)
+        )
+        return stmt, None
+    stmt = (
+        update(categories)
+        .where(categories.c.id == bindparam("b_id"), categories.c.user_id == user_id)
+        .values(display_order=bindparam("b_order"), change_seq=change_seq)
+    )
+    return stmt, [{"b_id": id_, "b_order": order} for id_, order in items]
+
+def site_layout_statement(dialect_name: str, user_id: int, items, change_seq: int):
+    """items は (id, order, category_id or None) のリスト。移動元・移動先の両カテゴリの所有者を確認します。"""
+    sites = Site.__table__
+    if dialect_name == "postgresql":
+        v = values(column("id", Integer), column("display_order", Integer), column("category_id", Integer), name="v").data(items)
+        # None は型なしの NULL として VALUES に埋め込まれ、全行が NULL (同じカテゴリ内の並べ替え) だと列が text 型になるので明示的にキャストする
+        v_id, v_order, v_category_id = (cast(c, Integer) for c in (v.c.id, v.c.display_order, v.c.category_id))
+        src = Category.__table__.alias("src")
+        dst = Category.__table__.alias("dst")
+        new_category_id = func.coalesce(v_category_id, sites.c.category_id)
+        stmt = (
+            update(sites)
+            .where(
+                sites.c.id == v_id,
+                src.c.id == sites.c.category_id, src.c.user_id == user_id,
+                dst.c.id == new_category_id, dst.c.user_id == user_id,
+            )
+            .values(display_order=v_order, category_id=new_category_id, change_seq=change_seq)
+        )
+        return stmt, None
+    owned = select(Category.id).where(Category.user_id == user_id)
+    new_category_id = func.coalesce(bindparam("b_category_id", type_=Integer), sites.c.category_id)
+    stmt = (
+        update(sites)
+        .where(sites.c.id == bindparam("b_id"), sites.c.category_id.in_(owned), new_category_id.in_(owned))
+        .values(display_order=bindparam("b_order"), category_id=new_category_id, change_seq=change_seq)
+    )
+    return stmt, [{"b_id": id_, "b_order": order, "b_category_id": category_id} for id_, order, category_id in items]
+
+def _execute_in_chunks(db: Session, build_statement, user_id: int, items: list, change_seq: int) -> int:
+    dialect_name = db.get_bind().dialect.name
+    updated = 0
+    for start in range(0, len(items), LAYOUT_CHUNK_SIZE):
+        stmt, params = build_statement(dialect_name, user_id, items[start:start + LAYOUT_CHUNK_SIZE], change_seq)
+        result = db.execute(stmt, params) if params is not None else db.execute(stmt)
+        updated += result.rowcount
+    return updated
+
+def category_order_items(order_updates: List[OrderUpdateRequest]) -> list:
+    return [(u.id, u.order) for u in _unique_by_id(order_updates)]
+
+def site_layout_items(order_updates: List[OrderUpdateRequest]) -> list:
+    return [(u.id, u.order, getattr(u, "category_id", None)) for u in _unique_by_id(order_updates)]
+
+def reorder_categories(db: Session, user_id: int, order_updates: List[OrderUpdateRequest], change_seq: int) -> bool:
+    """全件が自分のカテゴリとして更新できた場合に True を返します。更新した行には change_seq を記録します。"""
+    items = category_order_items(order_updates)
+    return _execute_in_chunks(db, category_order_statement, user_id, items, change_seq) == len(items)
+
+def reorder_sites(db: Session, user_id: int, order_updates: List[OrderUpdateRequest], change_seq: int) -> bool:
+    items = site_layout_items(order_updates)
+    return _execute_in_chunks(db, site_layout_statement, user_id, items, change_seq) == len(items)
+
+@router.post("/api/layout", response_model=LayoutResponse)
+def apply_layout(layout: LayoutRequest, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    """ボード全体の並び順とカテゴリ間の移動をまとめて1トランザクションで反映します。"""
+    version = bump_board_version(db, current_user.id)
+    if not reorder_categories(db, current_user.id, layout.categories, version) or not reorder_sites(db, current_user.id, layout.sites, version):
+        db.rollback()
+        raise HTTPException(status_code=403, detail="Permission denied to update one or more categories or sites")
+    db.commit()
+    return {"board_version": version}
+
+@router.post("/api/update-order/categories")
+def update_categories_order(order_updates: List[OrderUpdateRequest], db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    version = bump_board_version(db, current_user.id)
+    reorder_categories(db, current_user.id, order_updates, version) # 他人のカテゴリは条件で除外される (従来どおりエラーにはしない)
     db.commit()
-    return {"message": "Categories order updated"}
+    return {"message": "Categories order updated", "board_version": version}
 
-@app.post("/api/update-order/sites")
-def update_sites_order(order_updates: List[OrderUpdateRequest], db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    site_ids = [update.id for update in order_updates]
-    sites_to_update = db.query(Site).join(Category).filter(Site.id.in_(site_ids), Category.user_id == current_user.id).all()
-    if len(sites_to_update) != len(site_ids):
+@router.post("/api/update-order/sites")
+def update_sites_order(order_updates: List[OrderUpdateRequest], db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
+    version = bump_board_version(db, current_user.id)
+    if not reorder_sites(db, current_user.id, order_updates, version):
+        db.rollback()
         raise HTTPException(status_code=403, detail="Permission denied to update one or more sites")
-    
-    for update in order_updates:
-        for site in sites_to_update:
-            if site.id == update.id:
-                site.display_order = update.order
-                break
     db.commit()
-    return {"message": "Sites order updated"}
+    return {"message": "Sites order updated", "board_version": version}
 
-@app.post("/api/move-site")
-def move_site(move_request: MoveSiteRequest, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.post("/api/move-site")
+def move_site(move_request: MoveSiteRequest, db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user)):
     site_to_move = db.query(Site).join(Category).filter(Site.id == move_request.site_id, Category.user_id == current_user.id).first()
     dest_category = db.query(Category).filter(Category.id == move_request.new_category_id, Category.user_id == current_user.id).first()
 
@@ -299,5 +991,261 @@ def move_site(move_request: MoveSiteRequest, db: Session = Depends(get_db), curr
         raise HTTPException(status_code=404, detail="Site or destination category not found or permission denied")
         
     site_to_move.category_id = move_request.new_category_id
+    site_to_move.change_seq = bump_board_version(db, current_user.id)
     db.commit()
-    return {"message": "Site moved successfully"}
\ No newline at end of file
+    return {"message": "Site moved successfully"}
+
+# --- ブックマークの一括インポート/エクスポート ---
+IMPORT_BATCH_SIZE = 500
+METADATA_QUEUE_CHUNK = 50
+# 取り込み中の行の change_seq。board_version はアップロードを読み終えてから上げ (usersの行ロックを
+# アップロードの間ずっと持たないように)、そのときにこの値の行へまとめて記録する
+IMPORT_PENDING_SEQ = -1
+
+def site_favicon_url(url: str) -> str:
+    return f"https://www.google.com/s2/favicons?domain={urlparse(url).netloc}&sz=32"
+
+class BookmarkImport:
+    """1回のインポート中に参照/作成したカテゴリと、各カテゴリの次の display_order を覚えておきます。"""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.category_ids: dict = {} # カテゴリ名 -> id
+        self.next_order: dict = {} # category_id -> 次に使う display_order
+        self.next_category_order: Optional[int] = None
+        self.categories_created = 0
+        self.sites_created = 0
+        self.untitled: List[tuple] = [] # タイトル取得待ちの (site_id, url)
+
+    def batch_steps(self, items: List[BookmarkItem]):
+        """1バッチ分のSQLを (文, パラメータ) として順に yield し、実行結果を send で受け取るジェネレータ。
+        同期版/async版のどちらのセッションでも同じ手順でインポートできるようにしています。"""
+        if self.next_category_order is None:
+            count_stmt = select(func.count()).select_from(Category).where(Category.user_id == self.user_id)
+            self.next_category_order = (yield count_stmt, None).scalar_one()
+
+        names = sorted({item.category for item in items} - self.category_ids.keys())
+        if names:
+            existing_stmt = select(Category.name, Category.id).where(Category.user_id == self.user_id, Category.name.in_(names)).order_by(Category.id.desc())
+            existing = dict((yield existing_stmt, None).all()) # 同名が複数あれば一番古いカテゴリを使う
+            if existing:
+                counts_stmt = select(Site.category_id, func.count()).where(Site.category_id.in_(existing.values())).group_by(Site.category_id)
+                counts = dict((yield counts_stmt, None).all())
+                for name, category_id in existing.items():
+                    self.category_ids[name] = category_id
+                    self.next_order[category_id] = counts.get(category_id, 0)
+            new_names = [name for name in names if name not in existing]
+            if new_names:
+                rows = [
+                    {"name": name, "user_id": self.user_id, "display_order": self.next_category_order + i, "change_seq": IMPORT_PENDING_SEQ}
+                    for i, name in enumerate(new_names)
+                ]
+                self.next_category_order += len(rows)
+                created = (yield insert(Category).returning(Category.id, Category.name), rows).all()
+                for category_id, name in created:
+                    self.category_ids[name] = category_id
+                    self.next_order[category_id] = 0
+                self.categories_created += len(created)
+
+        site_rows = []
+        for item in items:
+            if item.url is None:
+                continue
+            category_id = self.category_ids[item.category]
+            site_rows.append({
+                "title": item.title or TITLE_PLACEHOLDER, "url": item.url, "favicon_url": site_favicon_url(item.url),
+                "display_order": self.next_order[category_id], "category_id": category_id, "change_seq": IMPORT_PENDING_SEQ,
+            })
+            self.next_order[category_id] += 1
+        if site_rows:
+            created = (yield insert(Site).returning(Site.id, Site.url, Site.title), site_rows).all()
+            self.untitled.extend((site_id, url) for site_id, url, title in created if title == TITLE_PLACEHOLDER)
+            self.sites_created += len(created)
+
+    def run_batch(self, db: Session, items: List[BookmarkItem]):
+        steps = self.batch_steps(items)
+        try:
+            stmt, params = next(steps)
+            while True:
+                result = db.execute(stmt, params) if params is not None else db.execute(stmt)
+                stmt, params = steps.send(result)
+        except StopIteration:
+            pass
+
+    @property
+    def created(self) -> bool:
+        return bool(self.categories_created or self.sites_created)
+
+    def stamp_statements(self, change_seq: int) -> list:
+        """取り込んだ行に、最後に上げた board_version を記録する文。(user_id, change_seq) のインデックスで絞ります。"""
+        categories = select(Category.id).where(Category.user_id == self.user_id)
+        return [
+            update(Category).where(Category.user_id == self.user_id, Category.change_seq == IMPORT_PENDING_SEQ).values(change_seq=change_seq),
+            update(Site).where(Site.category_id.in_(categories), Site.change_seq == IMPORT_PENDING_SEQ).values(change_seq=change_seq),
+        ]
+
+    def finish(self, db: Session) -> int:
+        """ボードのバージョンを上げて取り込んだ行に記録し、コミットします。何も作らなければバージョンはそのまま。"""
+        if not self.created:
+            version = get_board_version(db, self.user_id)
+        else:
+            version = bump_board_version(db, self.user_id)
+            for stmt in self.stamp_statements(version):
+                db.execute(stmt)
+        db.commit()
+        return version
+
+    def result(self, board_version: int) -> dict:
+        return {
+            "categories_created": self.categories_created, "sites_created": self.sites_created,
+            "metadata_queued": len(self.untitled), "board_version": board_version,
+        }
+
+async def queue_site_metadata(sites: List[tuple], fill=None):
+    """大量のサイトのタイトル取得を、少しずつ順番に行います。"""
+    fill = fill or fill_site_metadata
+    for start in range(0, len(sites), METADATA_QUEUE_CHUNK):
+        await fill(sites[start:start + METADATA_QUEUE_CHUNK])
+
+async def read_bookmark_batches(request: Request, format: Optional[str]):
+    """リクエストボディを少しずつ解析し、IMPORT_BATCH_SIZE 件ずつ返します。"""
+    chunks = request.stream()
+    first = b""
+    async for first in chunks:
+        if first:
+            break
+    fmt = format or detect_format(request.headers.get("content-type"), first)
+
+    async def body():
+        yield first
+        async for chunk in chunks:
+            yield chunk
+
+    batch = []
+    async for item in parse_stream(body(), fmt):
+        batch.append(item)
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@router.post("/api/import", response_model=ImportResponse)
+async def import_bookmarks(
+    request: Request, background_tasks: BackgroundTasks,
+    format: Optional[str] = Query(None, pattern="^(html|ndjson)$"),
+    db: Session = Depends(get_db), current_user: CurrentUser = Depends(get_current_user),
+):
+    """Netscape形式のHTMLまたはNDJSONをボディでそのまま受け取り、まとめてインポートします。"""
+    job = BookmarkImport(current_user.id)
+    try:
+        async for batch in read_bookmark_batches(request, format):
+            await run_in_threadpool(job.run_batch, db, batch)
+        version = await run_in_threadpool(job.finish, db)
+    except ValueError as exc:
+        await run_in_threadpool(db.rollback)
+        raise HTTPException(status_code=400, detail=f"Invalid bookmark file: {exc}")
+    if job.untitled:
+        background_tasks.add_task(queue_site_metadata, job.untitled)
+    return job.result(version)
+
+def export_query(user_id: int):
+    return (
+        select(Category.id, Category.name, Site.title, Site.url)
+        .outerjoin(Site, Site.category_id == Category.id)
+        .where(Category.user_id == user_id)
+        .order_by(Category.display_order, Category.id, Site.display_order, Site.id)
+        .execution_options(yield_per=1000) # サーバーサイドカーソルで少しずつ読む
+    )
+
+def export_response(chunks, fmt: str) -> StreamingResponse:
+    exporter_class = EXPORTERS[fmt]
+    return StreamingResponse(
+        chunks, media_type=exporter_class.media_type,
+        headers={"Content-Disposition": f'attachment; filename="bookmarks.{exporter_class.extension}"'},
+    )
+
+def stream_export(user_id: int, fmt: str):
+    exporter = EXPORTERS[fmt]()
+    buffer = exporter.start()
+    # レスポンスの送信中も使うので、依存性のセッションではなく専用のセッションを開く
+    db = SessionLocal()
+    try:
+        for row in db.execute(export_query(user_id)):
+            buffer += exporter.row(*row)
+            if len(buffer) >= EXPORT_CHUNK_SIZE:
+                yield buffer.encode("utf-8")
+                buffer = ""
+    finally:
+        db.close()
+    yield (buffer + exporter.end()).encode("utf-8")
+
+@router.get("/api/export")
+def export_bookmarks(format: str = Query("ndjson", pattern="^(html|ndjson)$"), current_user: CurrentUser = Depends(get_current_user)):
+    return export_response(stream_export(current_user.id, format), format)
+
+# --- 計測結果の出力 (Prometheus のテキスト形式) ---
+register_cache("dashboard", dashboard_cache)
+register_cache("search_index", search_index_cache)
+register_cache("token", token_cache)
+register_cache("user", user_cache)
+register_cache("page_metadata", fetcher.cache)
+
+def configure_caches():
+    """キャッシュの上限/TTLを settings に合わせます。async_api などが同じオブジェクトを参照しているので作り直さずに変更します。"""
+    token_cache.configure(settings.auth_cache_size, settings.token_cache_ttl)
+    user_cache.configure(settings.auth_cache_size, settings.auth_cache_ttl)
+    dashboard_cache.configure(settings.dashboard_cache_size)
+    search_index_cache.configure(settings.search_index_cache_size)
+
+def read_metrics():
+    # 同期版/async版のどちらでも同じ内容。ワーカーごとの値なので、複数ワーカーではワーカー単位で収集する
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# --- アプリケーションファクトリ ---
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """設定に従ってアプリを組み立てます。`uvicorn --factory main:create_app` でも起動できます。
+    app_settings を渡すと、そのDBにつなぎ直します (テストやベンチマークでSQLiteを使う場合など)。"""
+    global settings, engine, _google_cert_store
+    if app_settings is not None and app_settings != settings:
+        settings = app_settings
+        _google_cert_store = None
+        configure_caches()
+        if engine is not None: # 同期用のエンジンは次の get_engine で作り直す
+            engine.dispose()
+            engine = None
+            SessionLocal.configure(bind=None)
+
+    app = FastAPI(lifespan=lifespan)
+    # --- CORS設定 ---
+    app.add_middleware(CORSMiddleware, allow_origins=list(settings.cors_origins), allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
+    if settings.metrics_enabled:
+        app.add_middleware(MetricsMiddleware, slow_request_ms=settings.slow_request_ms) # 一番外側でCORSも含めた時間を測る
+        app.add_api_route("/metrics", read_metrics, methods=["GET"], include_in_schema=False)
+    if settings.async_db:
+        import async_api
+        async_api.reset_async_engine() # 次に使うときに今の settings で作る
+        app.include_router(async_api.router)
+    else:
+        app.include_router(router)
+    return app
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="データベースの管理コマンド")
+    parser.add_argument(
+        "command", choices=["migrate", "requeue-metadata"],
+        help="migrate: テーブルを作成し、既存のテーブルに足りない列とインデックスを追加する / "
+        "requeue-metadata: タイトル取得中のまま残ったサイトのタイトルを取得し直す",
+    )
+    args = parser.parse_args()
+    if args.command == "migrate":
+        changes = init_db()
+        for change in changes:
+            print(f"  {change}")
+        print(f"migrated: {make_url(settings.database_url).render_as_string(hide_password=True)} ({len(changes)} changes)")
+    elif args.command == "requeue-metadata":
+        print(f"requeued: {requeue_site_metadata()} sites")
+else:
+    app = create_app() # uvicorn main:app 用 (環境変数の設定で作成)
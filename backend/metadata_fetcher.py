@@ -0,0 +1,168 @@
+import asyncio
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from cache import LRUCache
+from metrics import observe_outbound
+
+# --- ページタイトル/説明文のバックグラウンド取得 ---
+# リクエスト処理中に外部サイトへアクセスしないよう、サイト登録後にイベントループ上で取得します。
+# httpx と BeautifulSoup は初めて取得するときにインポートします (起動時間の短縮)。
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
+TITLE_PLACEHOLDER = "タイトル取得中..."
+TITLE_FAILED = "タイトル取得失敗"
+
+_TITLE_END = re.compile(rb"</title\s*>", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class PageMetadata:
+    title: Optional[str]
+    description: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.title is not None
+
+
+def parse_head(html: bytes) -> PageMetadata:
+    """`</title>` までの断片から title と meta description を取り出します。"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    title_tag = soup.find("title")
+    title = title_tag.get_text(strip=True) if title_tag else None
+    description = None
+    meta = soup.find("meta", attrs={"name": re.compile("^description$", re.IGNORECASE)}) \
+        or soup.find("meta", attrs={"property": "og:description"})
+    if meta and meta.get("content"):
+        description = meta["content"].strip() or None
+    return PageMetadata(title=title or None, description=description)
+
+
+@dataclass
+class _HostLimit:
+    semaphore: asyncio.Semaphore
+    users: int = 0 # このセマフォを待っている/使っている取得の数
+
+
+class MetadataFetcher:
+    """共有コネクションプール・ホスト単位の同時実行数制限・URLキーの結果キャッシュを持つ取得器。"""
+
+    def __init__(
+        self,
+        timeout: float = 5.0,
+        max_connections: int = 50,
+        per_host_limit: int = 2,
+        max_bytes: int = 64 * 1024,
+        cache_size: int = 4096,
+        cache_ttl: float = 60 * 60,
+        failure_ttl: float = 5 * 60,
+    ):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.per_host_limit = per_host_limit
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._client = None # httpx.AsyncClient
+        self._host_limits: Dict[str, _HostLimit] = {} # 取得中のホストだけを持つ (使い終わったら削除)
+        self._global_limit: Optional[asyncio.Semaphore] = None # 大量に投入されてもプール待ちでタイムアウトしないように
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                headers={"User-Agent": USER_AGENT},
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections // 2),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @asynccontextmanager
+    async def _host_limit(self, host: str):
+        """ホスト単位の同時実行数を制限します。大量のURLを取得しても辞書が増え続けないよう、待っている/実行中の取得が無くなったら削除します。"""
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = _HostLimit(asyncio.Semaphore(self.per_host_limit))
+        limit.users += 1
+        try:
+            async with limit.semaphore:
+                yield
+        finally:
+            limit.users -= 1
+            if limit.users == 0:
+                del self._host_limits[host]
+
+    async def fetch(self, url: str) -> PageMetadata:
+        cached = self.cache.get(url)
+        if cached is not None:
+            return cached
+        # 同じURLへの同時リクエストは1本にまとめる
+        pending = self._inflight.get(url)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[url] = future
+        try:
+            result = await self._fetch_uncached(url)
+            self.cache.set(url, result, ttl=None if result.ok else self.failure_ttl)
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            future.set_exception(exc)
+            # 待っている側がいない場合に "exception was never retrieved" を出さないため
+            future.exception()
+            raise
+        finally:
+            del self._inflight[url]
+
+    async def _fetch_uncached(self, url: str) -> PageMetadata:
+        import httpx
+
+        host = urlparse(url).netloc
+        if not host:
+            return PageMetadata(title=None)
+        if self._global_limit is None:
+            self._global_limit = asyncio.Semaphore(self.max_connections)
+        async with self._host_limit(host), self._global_limit:
+            start = time.perf_counter() # 同時実行数の制限で待った時間は含めない
+            try:
+                async with self.client.stream("GET", url) as response:
+                    response.raise_for_status()
+                    buf = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        buf += chunk
+                        # </title> が来た時点、または上限サイズで読み込みを打ち切る
+                        if _TITLE_END.search(buf, max(0, len(buf) - len(chunk) - 16)) or len(buf) >= self.max_bytes:
+                            break
+            except httpx.HTTPError:
+                return PageMetadata(title=None)
+            finally:
+                observe_outbound("page_metadata", time.perf_counter() - start)
+        return parse_head(bytes(buf[: self.max_bytes]))
+
+    async def fetch_many(self, urls) -> Dict[str, PageMetadata]:
+        unique = list(dict.fromkeys(urls))
+        results = await asyncio.gather(*(self.fetch(url) for url in unique), return_exceptions=True)
+        return {
+            url: result if isinstance(result, PageMetadata) else PageMetadata(title=None)
+            for url, result in zip(unique, results)
+        }
+
+
+fetcher = MetadataFetcher()
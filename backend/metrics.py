@@ -0,0 +1,335 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# --- リクエスト単位の計測と Prometheus テキスト形式の出力 ---
+# 外部ライブラリを使わず、ヒストグラム/カウンタをプロセス内に保持して /metrics で出力します。
+# ワーカーを複数起動した場合は、ワーカーごとの値になります。
+
+logger = logging.getLogger("dashboard.slow")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+MAX_SLOW_STATEMENTS = 50 # 遅いリクエストのログに残すSQLの上限
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _le(bound: float) -> str:
+    return f'le="{_number(bound)}"'
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in items)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(buckets)
+        self._values: Dict[tuple, list] = {} # labels -> [バケットごとの件数..., 合計, 件数]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0] * (len(self.buckets) + 2)
+            if i < len(self.buckets):
+                state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(state)) for labels, state in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, state):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, _le(bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, _le(float('inf')))} {state[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """出力のたびに collect() を呼んで [(ラベル値のタプル, 値)] を得るゲージ。"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...], collect: Callable[[], list]):
+        self.name, self.help, self.labelnames, self.collect = name, help, labelnames, collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in self.collect())
+        return lines
+
+
+class CollectedCounter(Gauge):
+    """出力のたびに collect() で累計値を読み取るカウンタ (キャッシュのヒット数など、他のオブジェクトが数えているもの)。"""
+
+    type = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter("http_requests_total", "HTTPリクエスト数", ("method", "route", "status")))
+http_request_duration = registry.register(Histogram("http_request_duration_seconds", "HTTPリクエストの処理時間", ("method", "route")))
+request_queries = registry.register(Histogram("http_request_db_queries", "1リクエストあたりのSQL実行回数", ("method", "route"), COUNT_BUCKETS))
+request_db_time = registry.register(Histogram("http_request_db_seconds", "1リクエストあたりのSQL実行時間の合計", ("method", "route")))
+request_phase_duration = registry.register(Histogram("http_request_phase_seconds", "リクエスト内の処理段階ごとの時間", ("phase",)))
+db_query_duration = registry.register(Histogram("db_query_duration_seconds", "SQL1文の実行時間 (バックグラウンド処理を含む)"))
+db_pool_wait = registry.register(Histogram("db_pool_checkout_wait_seconds", "コネクションプールからの取得待ち時間 (新規接続を含む)"))
+outbound_duration = registry.register(Histogram("http_client_duration_seconds", "外部へのHTTPリクエストの時間", ("target",)))
+
+
+# --- リクエストごとの集計 ---
+@dataclass
+class RequestStats:
+    collect_statements: bool = False
+    queries: int = 0
+    db_time: float = 0.0
+    pool_wait: float = 0.0
+    outbound_time: float = 0.0
+    statements: List[Tuple[float, str]] = field(default_factory=list)
+    finished: bool = False # レスポンスを送り終えたら True。その後の BackgroundTasks のSQLや外部アクセスは加算しない
+
+    def add_statement(self, seconds: float, statement: str) -> None:
+        self.queries += 1
+        self.db_time += seconds
+        if self.collect_statements:
+            if len(self.statements) < MAX_SLOW_STATEMENTS:
+                self.statements.append((seconds, statement))
+            else:
+                # 上限を超えたら一番速い文と入れ替え、遅い文を優先して残す
+                fastest = min(range(len(self.statements)), key=lambda i: self.statements[i][0])
+                if seconds > self.statements[fastest][0]:
+                    self.statements[fastest] = (seconds, statement)
+
+
+# スレッドプールで動く同期版のエンドポイントにもコンテキストがコピーされるので、同じオブジェクトに加算される
+current_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def _request_stats() -> Optional[RequestStats]:
+    stats = current_stats.get()
+    return None if stats is None or stats.finished else stats
+
+
+def observe_query(seconds: float, statement: str) -> None:
+    db_query_duration.observe(seconds)
+    stats = _request_stats()
+    if stats is not None:
+        stats.add_statement(seconds, statement)
+
+
+def observe_pool_wait(seconds: float) -> None:
+    db_pool_wait.observe(seconds)
+    stats = _request_stats()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+
+def observe_outbound(target: str, seconds: float) -> None:
+    outbound_duration.observe(seconds, target)
+    stats = _request_stats()
+    if stats is not None:
+        stats.outbound_time += seconds
+
+
+@contextmanager
+def timed(phase: str):
+    """with timed("jwt_decode"): のように処理段階の時間を記録します。"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_phase_duration.observe(time.perf_counter() - start, phase)
+
+
+# --- SQLAlchemy へのフック ---
+def instrument_engine(engine) -> None:
+    """エンジン (async版は engine.sync_engine) の全SQLの実行時間を記録します。"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        observe_query(time.perf_counter() - conn.info["query_start"].pop(), statement)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+def timed_pool_class(pool_class):
+    """コネクションの取得にかかった時間を記録するプールクラスを作ります。"""
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                observe_pool_wait(time.perf_counter() - start)
+
+    TimedPool.__name__ = TimedPool.__qualname__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+# --- ASGIミドルウェア ---
+class MetricsMiddleware:
+    """ルート (パスのテンプレート) 単位でレイテンシとSQLの回数/時間を記録します。
+    slow_request_ms を指定すると、それより遅いリクエストを実行したSQLと一緒にログに出します。
+    時間はレスポンスの最後の body を送った時点までです (Starlette はその後に同じ呼び出しの中で BackgroundTasks を実行する)。"""
+
+    def __init__(self, app, slow_request_ms: float = 0, exclude_paths=("/metrics",)):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(collect_statements=self.slow_request_ms > 0)
+        token = current_stats.set(stats)
+        status_code = 500
+        start = time.perf_counter()
+
+        def finish():
+            if stats.finished:
+                return
+            stats.finished = True
+            elapsed = time.perf_counter() - start
+            route = getattr(scope.get("route"), "path", None) or "unmatched" # 実際のパスだとラベルが増え続けるのでテンプレートを使う
+            method = scope["method"]
+            http_requests.inc(method, route, str(status_code))
+            http_request_duration.observe(elapsed, method, route)
+            request_queries.observe(stats.queries, method, route)
+            request_db_time.observe(stats.db_time, method, route)
+            if self.slow_request_ms and elapsed * 1000 >= self.slow_request_ms:
+                self._log_slow(method, scope["path"], route, status_code, elapsed, stats)
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                finish()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            current_stats.reset(token)
+            finish() # レスポンスを返さずに終わった場合 (例外など)
+
+    def _log_slow(self, method, path, route, status_code, elapsed, stats: RequestStats) -> None:
+        lines = [
+            f"slow request {method} {path} ({route}) status={status_code} {elapsed * 1000:.1f}ms "
+            f"sql={stats.queries} sql_time={stats.db_time * 1000:.1f}ms pool_wait={stats.pool_wait * 1000:.1f}ms "
+            f"outbound={stats.outbound_time * 1000:.1f}ms"
+        ]
+        for seconds, statement in sorted(stats.statements, key=lambda s: s[0], reverse=True):
+            lines.append(f"  {seconds * 1000:.1f}ms {' '.join(statement.split())[:500]}")
+        logger.warning("\n".join(lines))
+
+
+# --- 出力時に値を読み取るゲージ ---
+_caches: Dict[str, object] = {}
+_pools: Dict[str, object] = {}
+
+
+def register_cache(name: str, cache) -> None:
+    """LRUCache.stats() (hits/misses/size/maxsize) を /metrics に出すようにします。"""
+    _caches[name] = cache
+
+
+def register_pool(name: str, pool) -> None:
+    """QueuePool の使用中/待機中のコネクション数を /metrics に出すようにします。プールの枯渇の検知に使います。"""
+    _pools[name] = pool
+
+
+def _collect_cache_sizes() -> list:
+    return [((name, stat), cache.stats()[stat]) for name, cache in _caches.items() for stat in ("size", "maxsize")]
+
+
+def _cache_counter(stat: str) -> Callable[[], list]:
+    return lambda: [((name,), cache.stats()[stat]) for name, cache in _caches.items()]
+
+
+def _collect_pools() -> list:
+    out = []
+    for name, pool in _pools.items():
+        for state in ("checkedout", "checkedin", "overflow", "size"):
+            method = getattr(pool, state, None) # StaticPool などには無く、SingletonThreadPool の size は属性
+            if callable(method):
+                out.append(((name, state), method()))
+    return out
+
+
+registry.register(CollectedCounter("cache_hits_total", "プロセス内キャッシュのヒット数", ("cache",), _cache_counter("hits")))
+registry.register(CollectedCounter("cache_misses_total", "プロセス内キャッシュのミス数", ("cache",), _cache_counter("misses")))
+registry.register(Gauge("cache_entries", "プロセス内キャッシュの件数と上限", ("cache", "stat"), _collect_cache_sizes))
+registry.register(Gauge("db_pool_connections", "コネクションプールの状態", ("engine", "state"), _collect_pools))
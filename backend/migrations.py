@@ -0,0 +1,74 @@
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, inspect, text
+from sqlalchemy.schema import DropIndex
+
+# --- 既存のデータベースへのスキーマ変更 ---
+# create_all は存在しないテーブルを作るだけで、既存のテーブルに列やインデックスを追加しません。
+# モデルに列/インデックスを追加したときは、main.py で @migration を付けた手順も追加してください。
+# 各手順は「無ければ追加する」形で書き、新しく作ったDBや適用済みのDBで何度実行しても何も変わらないようにします。
+
+MIGRATIONS: List[Tuple[str, Callable]] = [] # (名前, 手順) を登録順に実行する
+ADVISORY_LOCK_KEY = 4242001 # PostgreSQLで複数ワーカーが同時にマイグレーションしないためのロック
+
+
+def migration(name: str):
+    """手順を登録するデコレータ。関数は Migrator を受け取ります。"""
+
+    def register(step):
+        MIGRATIONS.append((name, step))
+        return step
+
+    return register
+
+
+class Migrator:
+    """1つのコネクション (トランザクション内) でDDLを実行し、実際に変更した内容を記録します。"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.dialect = conn.dialect
+        self.changes: List[str] = []
+
+    def _inspector(self):
+        return inspect(self.conn) # DDLのたびに結果が変わるので毎回作り直す
+
+    def add_column(self, column: Column) -> None:
+        table = column.table
+        if column.name in {c["name"] for c in self._inspector().get_columns(table.name)}:
+            return
+        spec = self.dialect.ddl_compiler(self.dialect, None).get_column_specification(column) # 型・DEFAULT・NOT NULL
+        self.conn.execute(text(f"ALTER TABLE {self.dialect.identifier_preparer.format_table(table)} ADD COLUMN {spec}"))
+        self.changes.append(f"add column {table.name}.{column.name}")
+
+    def create_index(self, index: Index) -> None:
+        """モデルに定義したインデックスを作成します。ddl_if で別のDB向けにしたものは作られません。"""
+        if self._inspector().has_index(index.table.name, index.name):
+            return
+        index.create(self.conn)
+        if self._inspector().has_index(index.table.name, index.name):
+            self.changes.append(f"create index {index.name}")
+
+    def drop_index(self, table_name: str, index_name: str) -> None:
+        if not self._inspector().has_index(table_name, index_name):
+            return
+        self.conn.execute(DropIndex(Index(index_name), if_exists=True))
+        self.changes.append(f"drop index {index_name}")
+
+    def execute(self, sql: str, dialect: Optional[str] = None) -> None:
+        """冪等なSQL (CREATE EXTENSION IF NOT EXISTS など) を実行します。dialect を指定するとそのDBだけで実行します。"""
+        if dialect is None or dialect == self.dialect.name:
+            self.conn.execute(text(sql))
+
+
+def run_migrations(conn, metadata) -> List[str]:
+    """新しいテーブルを作成してから、登録済みの手順を順に実行します。変更内容のリストを返します。"""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY}) # トランザクション終了で解放
+    metadata.create_all(conn)
+    migrator = Migrator(conn)
+    for name, step in MIGRATIONS:
+        before = len(migrator.changes)
+        step(migrator)
+        migrator.changes[before:] = [f"{name}: {change}" for change in migrator.changes[before:]]
+    return migrator.changes
@@ -0,0 +1,61 @@
+import heapq
+import re
+from bisect import bisect_left
+from typing import List, Sequence, Tuple
+
+# --- サイト検索用のメモリ内前方一致インデックス ---
+# PostgreSQL以外 (SQLiteなど) のときに使います。ユーザーごとに (トークン, 行番号) の
+# ソート済み配列を作り、二分探索で前方一致する範囲を取り出します。
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+TITLE_WEIGHT = 3 # タイトルでの一致はURLでの一致より上位にする
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").lower())
+
+
+class PrefixIndex:
+    """rows の各行は (site_id, title, url, ...) で始まるタプル。検索結果は元の行を返します。"""
+
+    def __init__(self, rows: Sequence[tuple]):
+        self.rows = list(rows)
+        entries = []
+        for i, row in enumerate(self.rows):
+            title, url = row[1], row[2]
+            entries.extend((token, i, TITLE_WEIGHT) for token in set(tokenize(title)))
+            entries.extend((token, i, 1) for token in set(tokenize(url)))
+        entries.sort()
+        self._tokens = [token for token, _, _ in entries]
+        self._postings = [(i, weight) for _, i, weight in entries]
+
+    def _matches(self, term: str) -> dict:
+        """term で始まるトークンを持つ行 -> スコア。完全一致は前方一致より高く数えます。"""
+        scores: dict = {}
+        start = bisect_left(self._tokens, term)
+        for pos in range(start, len(self._tokens)):
+            token = self._tokens[pos]
+            if not token.startswith(term):
+                break
+            i, weight = self._postings[pos]
+            score = weight * (2 if token == term else 1)
+            if score > scores.get(i, 0):
+                scores[i] = score
+        return scores
+
+    def search(self, query: str, limit: int, offset: int = 0) -> List[Tuple[float, tuple]]:
+        """全ての語に前方一致する行を、スコアの高い順に返します。"""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        scores = None
+        for term in sorted(set(terms), key=len, reverse=True): # 長い語ほど候補が少ないので先に絞る
+            matches = self._matches(term)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {i: score + matches[i] for i, score in scores.items() if i in matches}
+            if not scores:
+                return []
+        ranked = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], self.rows[item[0]][0]))
+        return [(float(score), self.rows[i]) for i, score in ranked[offset:offset + limit]]
@@ -0,0 +1,101 @@
+import os
+from dataclasses import dataclass, field
+from typing import List, Mapping, Optional, Tuple
+
+# --- アプリケーションの設定 ---
+# すべて環境変数から読み込みます。create_app(Settings(...)) のように直接渡せば、
+# テストやベンチマークでSQLiteなどのローカルのDBに向けて起動できます。
+
+# 既定のDSNとSECRET_KEYはローカルの開発用です。本番では環境変数で必ず指定してください (Settings.check_defaults)
+DB_USER = "s2422051"
+DB_PASSWORD = "mysecretpassword"
+DB_HOST = "localhost"
+DB_NAME = "s2422051"
+DEFAULT_DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+
+# ↓↓↓ 【重要】本番では環境変数 SECRET_KEY に必ずランダムな文字列を設定してください ↓↓↓
+# python -c 'import secrets; print(secrets.token_hex(32))'
+DEFAULT_SECRET_KEY = "your-super-secret-key-that-you-should-change"
+DEFAULT_GOOGLE_CLIENT_ID = "836421431313-gvb58qo9abkiu7lbiuqpqfqe9egte9j3.apps.googleusercontent.com"
+DEFAULT_CORS_ORIGINS = (
+    "http://localhost:5173",
+    "chrome-extension://836421431313-gvb58qo9abkiu7lbiuqpqfqe9egte9j3.apps.googleusercontent.com", # 拡張機能からのアクセスを許可
+)
+
+
+def _bool(value: str) -> bool:
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def is_development_database(url: str) -> bool:
+    """SQLite か、既定の開発用DSN (localhost) か。"""
+    return url == DEFAULT_DATABASE_URL or url.split(":", 1)[0].split("+", 1)[0] == "sqlite"
+
+
+@dataclass(frozen=True)
+class Settings:
+    database_url: str = DEFAULT_DATABASE_URL
+    # --- コネクションプール ---
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = False
+    db_query_cache_size: int = 500 # SQLAlchemyのコンパイル済みSQLキャッシュ
+    db_statement_cache_size: int = 100 # asyncpgのプリペアドステートメントキャッシュ
+    async_db: bool = False # True なら asyncio エンジン (asyncpg / aiosqlite) と async 版のエンドポイントで動く
+    auto_migrate: bool = False # True なら起動時にテーブルを作成する (開発/テスト用。本番は `python main.py migrate`)
+    # --- 認証 ---
+    secret_key: str = DEFAULT_SECRET_KEY
+    google_client_id: str = DEFAULT_GOOGLE_CLIENT_ID
+    google_certs_url: Optional[str] = None # None なら google_certs.GOOGLE_CERTS_URL
+    cors_origins: Tuple[str, ...] = field(default=DEFAULT_CORS_ORIGINS)
+    # --- 計測 (/metrics) ---
+    metrics_enabled: bool = True
+    slow_request_ms: float = 0 # 0より大きくすると、これより遅いリクエストを実行したSQLと一緒にログに出す
+    # --- プロセス内キャッシュ (件数の上限とTTL秒。ワーカーごとに持つ) ---
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 300 # user_id -> ユーザー情報
+    token_cache_ttl: float = 30 # トークン -> user_id。他のワーカーで失効したトークンを受け付けてしまう最大の秒数
+    dashboard_cache_size: int = 1024 # 0 にするとダッシュボードを毎回組み立てる
+    search_index_cache_size: int = 64 # SQLiteでの検索用のメモリ内インデックス (ユーザー単位)
+    # --- 差分同期 (/api/changes) ---
+    tombstone_retention_days: float = 30 # 削除の記録を残す日数。これより長く同期していないクライアントは全件を取り直す
+
+    def check_defaults(self) -> List[str]:
+        """既定の開発用の値を使っていれば警告の文言を返します。起動時に呼び出します。
+        既定の SECRET_KEY はソースに書かれていて誰でもトークンを作れるので、開発用以外のDBでは ValueError にします。"""
+        warnings = []
+        if self.secret_key == DEFAULT_SECRET_KEY:
+            if not is_development_database(self.database_url):
+                raise ValueError("SECRET_KEY must be set when DATABASE_URL is not a development database")
+            warnings.append("SECRET_KEY is not set; using the built-in development key")
+        if self.database_url == DEFAULT_DATABASE_URL:
+            warnings.append("DATABASE_URL is not set; using the built-in development database")
+        return warnings
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str] = os.environ) -> "Settings":
+        default = cls()
+        get = environ.get
+        cors = get("CORS_ORIGINS")
+        return cls(
+            database_url=get("DATABASE_URL", default.database_url),
+            db_pool_size=int(get("DB_POOL_SIZE", default.db_pool_size)),
+            db_max_overflow=int(get("DB_MAX_OVERFLOW", default.db_max_overflow)),
+            db_pool_pre_ping=_bool(get("DB_POOL_PRE_PING", "0")),
+            db_query_cache_size=int(get("DB_QUERY_CACHE_SIZE", default.db_query_cache_size)),
+            db_statement_cache_size=int(get("DB_STATEMENT_CACHE_SIZE", default.db_statement_cache_size)),
+            async_db=_bool(get("ASYNC_DB", "0")),
+            auto_migrate=_bool(get("DB_AUTO_MIGRATE", "0")),
+            secret_key=get("SECRET_KEY", default.secret_key),
+            google_client_id=get("GOOGLE_CLIENT_ID", default.google_client_id),
+            google_certs_url=get("GOOGLE_CERTS_URL") or None,
+            cors_origins=tuple(o.strip() for o in cors.split(",") if o.strip()) if cors else default.cors_origins,
+            metrics_enabled=_bool(get("METRICS_ENABLED", "1")),
+            slow_request_ms=float(get("SLOW_REQUEST_MS", default.slow_request_ms)),
+            auth_cache_size=int(get("AUTH_CACHE_SIZE", default.auth_cache_size)),
+            auth_cache_ttl=float(get("AUTH_CACHE_TTL", default.auth_cache_ttl)),
+            token_cache_ttl=float(get("TOKEN_CACHE_TTL", default.token_cache_ttl)),
+            dashboard_cache_size=int(get("DASHBOARD_CACHE_SIZE", default.dashboard_cache_size)),
+            search_index_cache_size=int(get("SEARCH_INDEX_CACHE_SIZE", default.search_index_cache_size)),
+            tombstone_retention_days=float(get("TOMBSTONE_RETENTION_DAYS", default.tombstone_retention_days)),
+        )
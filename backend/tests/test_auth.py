@@ -0,0 +1,61 @@
+"""認証 (main.get_current_user) のキャッシュが、ユーザーの削除やトークンの失効で無効になることのテスト。"""
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def clear_auth_caches():
+    main.token_cache.clear()
+    main.user_cache.clear()
+    yield
+    main.token_cache.clear()
+    main.user_cache.clear()
+
+
+@pytest.fixture
+def login(db, make_board):
+    board = make_board(categories=(), sites=0)
+    token = main.create_access_token(data={"sub": board.user.email, "user_id": board.user.id})
+    assert main.get_current_user(db=db, token=token) == board.current_user # キャッシュに載せる
+    return board, token
+
+
+def assert_rejected(db, token):
+    with pytest.raises(HTTPException) as excinfo:
+        main.get_current_user(db=db, token=token)
+    assert excinfo.value.status_code == 401
+
+
+def test_invalidate_user(db, login):
+    board, token = login
+    db.execute(delete(main.User).where(main.User.id == board.user.id)) # ORMのイベントを通らない削除
+    db.commit()
+    assert main.get_current_user(db=db, token=token) == board.current_user # キャッシュが残っている
+
+    main.invalidate_user(board.user.id)
+    assert_rejected(db, token)
+
+
+def test_deleting_user_invalidates_cache(db, login):
+    board, token = login
+    db.delete(board.user) # after_delete でキャッシュを破棄
+    db.commit()
+    assert_rejected(db, token)
+
+
+def test_revoke_token(db, login):
+    board, token = login
+    main.revoke_token(db, token)
+    db.commit()
+    assert_rejected(db, token)
+
+    # 別のワーカー (トークンがキャッシュに無い) でもDBの失効記録で拒否する
+    main.token_cache.clear()
+    assert_rejected(db, token)
+
+    # 他のトークンは影響を受けない
+    other = main.create_access_token(data={"sub": board.user.email, "user_id": board.user.id, "n": 2})
+    assert main.get_current_user(db=db, token=other) == board.current_user
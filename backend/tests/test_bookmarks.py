@@ -0,0 +1,123 @@
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import select
+
+import main
+from bookmarks import DEFAULT_CATEGORY, BookmarkItem, HtmlExporter, NdjsonExporter, parse_stream
+
+NETSCAPE_HTML = """<!DOCTYPE NETSCAPE-Bookmark-file-1>
+<TITLE>Bookmarks</TITLE>
+<DL><p>
+    <DT><H3>Dev</H3>
+    <DL><p>
+        <DT><A HREF="https://docs.python.org/">Python &amp; docs</A>
+        <DT><H3>Tools</H3>
+        <DL><p>
+            <DT><A HREF="http://example.com/tool">Tool</A>
+            <DT><A HREF="javascript:alert(1)">Bookmarklet</A>
+        </DL><p>
+        <DT><A HREF="https://pypi.org/"></A>
+    </DL><p>
+    <DT><A HREF="place:sort=8">Recent</A>
+    <DT><A HREF="https://top.example/">Top</A>
+</DL><p>
+"""
+
+
+def parse(data: bytes, fmt: str, chunk_size: int = 7) -> list:
+    """チャンクの境界で解析が壊れないよう、わざと細かく分けて渡します。"""
+
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    async def collect():
+        return [item async for item in parse_stream(chunks(), fmt)]
+
+    return asyncio.run(collect())
+
+
+def test_html_folders_and_links():
+    assert parse(NETSCAPE_HTML.encode("utf-8"), "html") == [
+        BookmarkItem(category="Dev"),
+        BookmarkItem(category="Dev", url="https://docs.python.org/", title="Python & docs"),
+        BookmarkItem(category="Tools"),
+        BookmarkItem(category="Tools", url="http://example.com/tool", title="Tool"),
+        BookmarkItem(category="Dev", url="https://pypi.org/", title=None),
+        BookmarkItem(category=DEFAULT_CATEGORY, url="https://top.example/", title="Top"),
+    ]
+
+
+def test_ndjson_records():
+    data = "\n".join([
+        '{"category": "日本語", "url": "https://example.jp/", "title": "例"}',
+        "",
+        '{"url": "https://no-category.example/"}',
+        '{"category": "Empty"}',
+        '{"category": "Scripts", "url": "javascript:alert(1)", "title": "x"}',
+        '{"category": "Last", "url": "http://last.example/"}',
+    ]).encode("utf-8")
+    assert parse(data, "ndjson") == [
+        BookmarkItem(category="日本語", url="https://example.jp/", title="例"),
+        BookmarkItem(category=DEFAULT_CATEGORY, url="https://no-category.example/"),
+        BookmarkItem(category="Empty"),
+        BookmarkItem(category="Scripts"), # HTMLと同じく http/https 以外は取り込まず、カテゴリだけを作る
+        BookmarkItem(category="Last", url="http://last.example/"),
+    ]
+
+
+@pytest.mark.parametrize("line", [
+    "[1]",
+    '"str"',
+    "42",
+    "null",
+    "{broken",
+    '{"category": ["a"], "url": "https://example.com/"}',
+    '{"category": "a", "url": 1}',
+    '{"category": "a", "url": "https://example.com/", "title": {"t": 1}}',
+])
+def test_ndjson_invalid_lines_raise_value_error(line):
+    data = ('{"category": "ok"}\n' + line + "\n").encode("utf-8")
+    with pytest.raises(ValueError, match="line 2"):
+        parse(data, "ndjson")
+
+
+@pytest.mark.parametrize("exporter_class,fmt", [(NdjsonExporter, "ndjson"), (HtmlExporter, "html")])
+def test_export_round_trip(exporter_class, fmt):
+    rows = [(1, "A & B", "Site <1>", "https://a.example/?x=1&y=2"), (1, "A & B", None, "https://b.example/"), (2, "Empty", None, None)]
+    exporter = exporter_class()
+    text = exporter.start() + "".join(exporter.row(*row) for row in rows) + exporter.end()
+    assert parse(text.encode("utf-8"), fmt) == [
+        *([BookmarkItem(category="A & B")] if fmt == "html" else []),
+        BookmarkItem(category="A & B", url="https://a.example/?x=1&y=2", title="Site <1>"),
+        # HTMLではタイトルが無いとURLをタイトルとして書き出す
+        BookmarkItem(category="A & B", url="https://b.example/", title="https://b.example/" if fmt == "html" else None),
+        BookmarkItem(category="Empty"),
+    ]
+
+
+def test_import_bumps_version_after_the_upload(db, make_board):
+    board = make_board(bump_version=True)
+    before = db.get(main.User, board.user.id).board_version
+    job = main.BookmarkImport(board.user.id)
+    job.run_batch(db, [BookmarkItem(category="first", url="https://a.example/", title="A"), BookmarkItem(category="new")])
+    job.run_batch(db, [BookmarkItem(category="new", url="https://b.example/")])
+    # 取り込み中はバージョンを上げない (users の行をロックしない)
+    assert db.execute(select(main.User.board_version).where(main.User.id == board.user.id)).scalar_one() == before
+
+    version = job.finish(db)
+    assert version == before + 1
+    assert job.result(version) == {"categories_created": 1, "sites_created": 2, "metadata_queued": 1, "board_version": version}
+    changes = json.loads(main.read_changes(since=before, db=db, current_user=board.current_user).body)
+    assert [category["name"] for category in changes["categories"]] == ["new"]
+    assert sorted(site["url"] for site in changes["sites"]) == ["https://a.example/", "https://b.example/"]
+    assert db.scalar(select(main.Site.id).where(main.Site.change_seq == main.IMPORT_PENDING_SEQ)) is None
+
+
+def test_empty_import_keeps_version(db, make_board):
+    board = make_board(bump_version=True)
+    job = main.BookmarkImport(board.user.id)
+    job.run_batch(db, [BookmarkItem(category="first")])
+    assert job.finish(db) == db.get(main.User, board.user.id).board_version == 1
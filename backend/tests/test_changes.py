@@ -0,0 +1,81 @@
+"""差分同期 (/api/changes) と削除記録 (tombstones) の保持期間のテスト。エンドポイントの関数を直接呼び出します。"""
+import json
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+import main
+
+
+def read_changes(db: Session, current_user, since: int) -> dict:
+    return json.loads(main.read_changes(since=since, db=db, current_user=current_user).body)
+
+
+def version(db: Session, user_id: int) -> int:
+    return main.get_board_version(db, user_id)
+
+
+def test_changes_since_returns_deleted_sites(db, make_board):
+    board = make_board(bump_version=True)
+    current_user, (first, second, _) = board.current_user, board.site_ids
+    since = version(db, current_user.id)
+    main.delete_site(first, db=db, current_user=current_user)
+    main.delete_site(second, db=db, current_user=current_user)
+
+    body = read_changes(db, current_user, since)
+    assert body["full"] is False
+    assert body["deleted_sites"] == [first, second]
+    assert body["version"] == since + 2
+
+
+def test_full_sync_includes_rows_from_before_change_seq(db, make_board):
+    board = make_board(bump_version=True)
+    current_user, site_ids = board.current_user, board.site_ids
+    # マイグレーションで change_seq 列を追加した行は 0 のまま
+    db.execute(update(main.Site).values(change_seq=0))
+    db.commit()
+
+    body = read_changes(db, current_user, 0)
+    assert body["full"] is True
+    assert sorted(site["id"] for site in body["sites"]) == site_ids
+
+
+def test_expired_tombstones_are_pruned_and_force_full_sync(db, make_board):
+    board = make_board(bump_version=True)
+    current_user, (first, second, third) = board.current_user, board.site_ids
+    before_first = version(db, current_user.id)
+    main.delete_site(first, db=db, current_user=current_user)
+    after_first = version(db, current_user.id)
+    # 1件目の削除記録を保持期間より古くする
+    db.execute(update(main.Tombstone).where(main.Tombstone.object_id == first).values(deleted_at=0))
+    db.commit()
+
+    main.delete_site(second, db=db, current_user=current_user)
+    assert db.execute(select(main.Tombstone.object_id).where(main.Tombstone.user_id == current_user.id)).scalars().all() == [second]
+
+    # 消した記録より前からの差分は作れないので全件を返す
+    body = read_changes(db, current_user, before_first)
+    assert body["full"] is True
+    assert body["deleted_sites"] == []
+    assert [site["id"] for site in body["sites"]] == [third]
+
+    # 消した記録以降からなら差分のまま
+    body = read_changes(db, current_user, after_first)
+    assert body["full"] is False
+    assert body["deleted_sites"] == [second]
+
+
+def test_deleting_category_records_its_sites(db, make_board):
+    # 同期後にサイトを別のカテゴリへ移動してからそのカテゴリを消すと、クライアントには元のカテゴリにサイトが残っていた
+    board = make_board(bump_version=True)
+    current_user, (_, second), (moved, kept, _) = board.current_user, board.categories, board.site_ids
+    since = version(db, current_user.id)
+    layout = main.LayoutRequest(sites=[main.LayoutSite(id=moved, order=0, category_id=second.id)])
+    main.apply_layout(layout, db=db, current_user=current_user)
+    main.delete_category(second.id, db=db, current_user=current_user)
+
+    body = read_changes(db, current_user, since)
+    assert body["full"] is False
+    assert body["deleted_categories"] == [second.id]
+    assert body["deleted_sites"] == [moved]
+    assert kept not in [site["id"] for site in body["sites"]]
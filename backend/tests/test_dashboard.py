@@ -0,0 +1,62 @@
+"""ダッシュボード (main.read_categories) の ETag と、プロセス内キャッシュのテスト。"""
+import dataclasses
+import json
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def clear_dashboard_cache():
+    main.dashboard_cache.clear() # キャッシュのキーは user_id なので、テストごとのDBで同じidが使われる
+    yield
+    main.dashboard_cache.clear()
+
+
+def read(db, board, if_none_match=None):
+    return main.read_categories(db=db, current_user=board.current_user, if_none_match=if_none_match)
+
+
+def test_if_none_match_returns_304(db, make_board):
+    board = make_board(bump_version=True)
+    response = read(db, board)
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+    assert [category["name"] for category in json.loads(response.body)] == ["first", "second"]
+
+    for header in (etag, f"W/{etag}", f'"other", {etag}', "*"):
+        not_modified = read(db, board, header)
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == etag
+        assert not not_modified.body
+    assert read(db, board, '"other"').status_code == 200
+
+
+def test_mutation_changes_etag(db, make_board):
+    board = make_board(bump_version=True)
+    etag = read(db, board).headers["ETag"]
+
+    main.create_category(main.CategoryCreate(name="third"), db=db, current_user=board.current_user)
+    response = read(db, board, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert [category["name"] for category in json.loads(response.body)] == ["first", "second", "third"]
+
+
+def test_dashboard_cache_size_is_respected(db, make_board, monkeypatch):
+    monkeypatch.setattr(main, "settings", dataclasses.replace(main.settings, dashboard_cache_size=2))
+    main.configure_caches()
+    try:
+        boards = [make_board(email=f"user{i}@example.com", bump_version=True) for i in range(3)]
+        for board in boards:
+            assert read(db, board).status_code == 200
+        assert len(main.dashboard_cache) == 2
+        assert main.dashboard_cache.get(boards[0].user.id) is None # 一番古いものから捨てる
+    finally:
+        monkeypatch.undo()
+        main.configure_caches()
+
+
+def test_dashboard_cache_size_from_env():
+    assert main.Settings.from_env({"DASHBOARD_CACHE_SIZE": "0"}).dashboard_cache_size == 0
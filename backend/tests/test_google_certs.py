@@ -0,0 +1,142 @@
+"""Google IDトークンの検証 (google_certs.GoogleCertStore) のテスト。
+
+Googleの代わりに生成したRSA鍵のJWKSを使い、ネットワークなしで検証します。
+"""
+import base64
+import threading
+import time
+
+import pytest
+import rsa
+from google.auth import crypt, jwt
+
+from google_certs import GoogleCertStore, StaticCertSource
+
+AUDIENCE = "client-id.apps.googleusercontent.com"
+
+
+def _b64(value: int) -> str:
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class Key:
+    def __init__(self, kid: str):
+        self.kid = kid
+        self.public, self.private = rsa.newkeys(1024)
+
+    @property
+    def jwk(self) -> dict:
+        return {"kty": "RSA", "alg": "RS256", "use": "sig", "kid": self.kid, "n": _b64(self.public.n), "e": _b64(self.public.e)}
+
+    def sign(self, **claims) -> str:
+        now = int(time.time())
+        payload = {"iss": "https://accounts.google.com", "aud": AUDIENCE, "sub": "123", "email": "user@example.com", "iat": now, "exp": now + 300}
+        payload.update(claims)
+        signer = crypt.RSASigner.from_string(self.private.save_pkcs1().decode("ascii"), key_id=self.kid)
+        return jwt.encode(signer, payload).decode("ascii")
+
+
+def jwks(*keys: Key) -> dict:
+    return {"keys": [key.jwk for key in keys]}
+
+
+@pytest.fixture(scope="module")
+def keys():
+    return Key("key-1"), Key("key-2")
+
+
+class ScriptedSource:
+    """fetch のたびに responses を順に返します (例外なら送出)。呼ばれた回数を数えます。"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def fetch(self):
+        response = self.responses[min(self.calls, len(self.responses) - 1)]
+        self.calls += 1
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def test_verify_with_local_jwks(keys):
+    store = GoogleCertStore(StaticCertSource(jwks(*keys), max_age=3600))
+    idinfo = store.verify(keys[1].sign(), AUDIENCE)
+    assert idinfo["email"] == "user@example.com"
+
+
+@pytest.mark.parametrize("make_token", [
+    lambda key: "not-a-jwt",
+    lambda key: key.sign()[:-4] + "AAAA", # 署名の改ざん
+    lambda key: key.sign(exp=int(time.time()) - 3600),
+    lambda key: key.sign(iss="https://evil.example"),
+    lambda key: Key("key-1").sign(), # 同じkidの別の鍵
+], ids=["malformed", "bad-signature", "expired", "wrong-issuer", "other-key"])
+def test_bad_tokens_raise_value_error(keys, make_token):
+    store = GoogleCertStore(StaticCertSource(jwks(*keys), max_age=3600))
+    with pytest.raises(ValueError):
+        store.verify(make_token(keys[0]), AUDIENCE)
+
+
+def test_wrong_audience_raises_value_error(keys):
+    store = GoogleCertStore(StaticCertSource(jwks(*keys), max_age=3600))
+    with pytest.raises(ValueError):
+        store.verify(keys[0].sign(aud="someone-else"), AUDIENCE)
+
+
+def test_unknown_kid_refreshes_once_per_interval(keys):
+    old, new = keys
+    source = ScriptedSource((StaticCertSource(jwks(old)).certs, 3600), (StaticCertSource(jwks(old, new)).certs, 3600))
+    store = GoogleCertStore(source, min_refresh_interval=0)
+    store.get_certs()
+
+    # 鍵のローテーション後のトークンは取り直して検証できる
+    assert store.verify(new.sign(), AUDIENCE)["sub"] == "123"
+    assert source.calls == 2
+
+    # 取り直しても見つからないkidは、間隔を空けるまで取り直さない
+    store.min_refresh_interval = 3600
+    with pytest.raises(ValueError):
+        store.verify(Key("key-3").sign(), AUDIENCE)
+    assert source.calls == 2
+
+
+def test_failed_refresh_keeps_cached_keys(keys):
+    source = ScriptedSource((StaticCertSource(jwks(*keys)).certs, 0), RuntimeError("network down"))
+    store = GoogleCertStore(source)
+    store.get_certs() # max_age=0 なのですぐに期限切れになる
+
+    assert store.verify(keys[0].sign(), AUDIENCE)["sub"] == "123"
+    assert source.calls == 2
+
+
+def test_failed_first_fetch_raises():
+    store = GoogleCertStore(ScriptedSource(RuntimeError("network down")))
+    with pytest.raises(RuntimeError):
+        store.get_certs()
+
+
+def test_concurrent_expired_callers_fetch_once(keys):
+    certs = StaticCertSource(jwks(*keys)).certs
+    release = threading.Event()
+
+    class SlowSource(ScriptedSource):
+        def fetch(self):
+            if self.calls:
+                release.wait(5)
+            return super().fetch()
+
+    source = SlowSource((certs, 0), (certs, 3600))
+    store = GoogleCertStore(source)
+    store.get_certs()
+
+    threads = [threading.Thread(target=store.get_certs) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05) # 全員がロックで待つまで
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert source.calls == 2
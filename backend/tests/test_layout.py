@@ -0,0 +1,48 @@
+"""並び順の一括更新 (reorder_sites / site_layout_statement) のテスト。
+
+SQLiteでは executemany の文を、TEST_POSTGRES_URL を指定したときは PostgreSQL の UPDATE ... FROM (VALUES ...) の文を実行します。
+"""
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+
+import main
+
+
+def site_rows(db: Session, site_ids):
+    rows = db.execute(select(main.Site.id, main.Site.category_id, main.Site.display_order, main.Site.change_seq).where(main.Site.id.in_(site_ids)))
+    return {site_id: (category_id, order, change_seq) for site_id, category_id, order, change_seq in rows}
+
+
+def test_postgres_statement_casts_values_columns():
+    # 全件の category_id が None だと、VALUES の列が text 型になって coalesce が失敗していた
+    stmt, params = main.site_layout_statement("postgresql", 1, [(10, 0, None), (11, 1, None)], 5)
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+    assert params is None
+    assert "coalesce(CAST(v.category_id AS INTEGER), sites.category_id)" in sql
+    assert "sites.id = CAST(v.id AS INTEGER)" in sql
+
+
+def test_reorder_within_category(db, make_board):
+    user, (first, _), (a, b, c) = make_board()
+    updates = [main.OrderUpdateRequest(id=a, order=2), main.OrderUpdateRequest(id=c, order=0)]
+    assert main.reorder_sites(db, user.id, updates, change_seq=7)
+    assert site_rows(db, [a, b, c]) == {a: (first.id, 2, 7), b: (first.id, 1, 0), c: (first.id, 0, 7)}
+
+
+def test_move_and_reorder_in_one_layout(db, make_board):
+    user, (first, second), (a, b, c) = make_board()
+    updates = [main.LayoutSite(id=b, order=0, category_id=second.id), main.LayoutSite(id=c, order=1)]
+    assert main.reorder_sites(db, user.id, updates, change_seq=3)
+    assert site_rows(db, [a, b, c]) == {a: (first.id, 0, 0), b: (second.id, 0, 3), c: (first.id, 1, 3)}
+
+
+def test_other_users_sites_are_not_updated(db, make_board):
+    user, (first, _), (a, _, _) = make_board()
+    _, (other_category, _), (other_site, _, _) = make_board("other@example.com")
+    updates = [main.OrderUpdateRequest(id=a, order=1), main.OrderUpdateRequest(id=other_site, order=9)]
+    assert not main.reorder_sites(db, user.id, updates, change_seq=4) # エンドポイントはこの結果でロールバックする
+    assert site_rows(db, [other_site])[other_site] == (other_category.id, 0, 0)
+    # 他人のカテゴリへ移動することもできない
+    assert not main.reorder_sites(db, user.id, [main.LayoutSite(id=a, order=0, category_id=other_category.id)], change_seq=5)
+    assert site_rows(db, [a])[a][0] == first.id
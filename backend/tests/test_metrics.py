@@ -0,0 +1,60 @@
+"""MetricsMiddleware と /metrics の出力のテスト。"""
+import time
+
+from fastapi import BackgroundTasks, FastAPI
+from fastapi.testclient import TestClient
+
+import metrics
+from cache import LRUCache
+
+
+def background_work():
+    time.sleep(0.3)
+    metrics.observe_query(0.3, "SELECT 1")
+    metrics.observe_outbound("page_metadata", 0.3)
+
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.post("/test/background")
+    def with_background(background_tasks: BackgroundTasks):
+        metrics.observe_query(0.001, "SELECT 1")
+        background_tasks.add_task(background_work)
+        return {"ok": True}
+
+    return app
+
+
+def histogram_state(histogram, *labels):
+    return list(histogram._values.get(labels, [0] * (len(histogram.buckets) + 2)))
+
+
+def test_background_tasks_are_not_charged_to_the_request():
+    before_duration = histogram_state(metrics.http_request_duration, "POST", "/test/background")
+    before_queries = histogram_state(metrics.request_queries, "POST", "/test/background")
+    with TestClient(make_app()) as client:
+        started = time.perf_counter()
+        assert client.post("/test/background").status_code == 200
+        assert time.perf_counter() - started >= 0.3 # TestClient はバックグラウンド処理の終了まで待つ
+
+    duration = histogram_state(metrics.http_request_duration, "POST", "/test/background")
+    queries = histogram_state(metrics.request_queries, "POST", "/test/background")
+    assert duration[-1] - before_duration[-1] == 1
+    assert duration[-2] - before_duration[-2] < 0.3
+    assert queries[-2] - before_queries[-2] == 1 # 記録されるのはハンドラ内の1文だけ
+
+
+def test_cache_hits_and_misses_are_counters():
+    cache = LRUCache(maxsize=2)
+    metrics.register_cache("test_cache", cache)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("b")
+    lines = metrics.registry.render().splitlines()
+    assert "# TYPE cache_hits_total counter" in lines
+    assert "# TYPE cache_misses_total counter" in lines
+    assert 'cache_hits_total{cache="test_cache"} 1' in lines
+    assert 'cache_misses_total{cache="test_cache"} 1' in lines
+    assert 'cache_entries{cache="test_cache",stat="maxsize"} 2' in lines
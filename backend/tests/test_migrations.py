@@ -0,0 +1,61 @@
+"""既存のDB (最初のリリースのスキーマ) に対するマイグレーション (main.upgrade_schema) のテスト。
+
+TEST_POSTGRES_URL を指定すると PostgreSQL でも実行します (pg_trgm 拡張が必要)。
+"""
+import pytest
+from sqlalchemy import inspect, text
+
+import main
+
+# 最初のリリースの create_all で作られていたテーブル
+BASELINE_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, email VARCHAR, google_id VARCHAR)",
+    "CREATE UNIQUE INDEX ix_users_email ON users (email)",
+    "CREATE TABLE categories (id INTEGER PRIMARY KEY, name VARCHAR, display_order INTEGER, user_id INTEGER REFERENCES users (id))",
+    "CREATE INDEX ix_categories_name ON categories (name)",
+    "CREATE TABLE sites (id INTEGER PRIMARY KEY, title VARCHAR, url VARCHAR, favicon_url VARCHAR, display_order INTEGER, category_id INTEGER REFERENCES categories (id))",
+    "CREATE INDEX ix_sites_title ON sites (title)",
+    "CREATE INDEX ix_sites_url ON sites (url)",
+    "INSERT INTO users (id, email, google_id) VALUES (1, 'old@example.com', 'old')",
+    "INSERT INTO categories (id, name, display_order, user_id) VALUES (1, 'old', 0, 1)",
+    "INSERT INTO sites (id, title, url, display_order, category_id) VALUES (1, 'old', 'https://old.example/', 0, 1)",
+]
+
+
+@pytest.fixture
+def conn(connection):
+    for sql in BASELINE_SCHEMA:
+        connection.execute(text(sql))
+    return connection
+
+
+def columns(conn, table: str):
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def indexes(conn, table: str):
+    return {index["name"] for index in inspect(conn).get_indexes(table)}
+
+
+def test_upgrade_baseline_schema(conn):
+    changes = main.upgrade_schema(conn)
+    assert changes
+
+    assert {"board_version", "tombstones_pruned_seq"} <= columns(conn, "users")
+    assert "change_seq" in columns(conn, "categories")
+    assert {"change_seq", "description"} <= columns(conn, "sites")
+    assert {"ix_categories_user_id_display_order", "ix_categories_user_id_change_seq"} <= indexes(conn, "categories")
+    assert {"ix_sites_category_id_display_order", "ix_sites_category_id_change_seq"} <= indexes(conn, "sites")
+    assert "deleted_at" in columns(conn, "tombstones")
+    if conn.dialect.name == "postgresql":
+        assert {"ix_sites_search_tsv", "ix_sites_title_trgm", "ix_sites_url_trgm"} <= indexes(conn, "sites")
+        assert not {"ix_sites_title", "ix_sites_url"} & indexes(conn, "sites")
+
+    # 既存の行は server_default で埋まる
+    assert conn.execute(text("SELECT board_version, tombstones_pruned_seq FROM users")).one() == (0, 0)
+    assert conn.execute(text("SELECT change_seq FROM sites")).scalar_one() == 0
+
+
+def test_upgrade_is_idempotent(conn):
+    main.upgrade_schema(conn)
+    assert main.upgrade_schema(conn) == []
@@ -0,0 +1,83 @@
+"""SQLite のメモリ内インデックスによるサイト検索 (main.search_sites) と、その構築の single-flight のテスト。"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import main
+from cache import SingleFlight
+
+
+def test_single_flight_shares_one_call_between_threads():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def build():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return object()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        leader = pool.submit(flight.do, "key", build)
+        started.wait(5)
+        waiters = [pool.submit(flight.do, "key", build) for _ in range(3)]
+        release.set()
+        results = [leader.result(5), *(waiter.result(5) for waiter in waiters)]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert len(flight) == 0
+
+
+def test_single_flight_async_and_errors():
+    flight = SingleFlight()
+    calls = []
+
+    async def build():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        assert await asyncio.gather(*(flight.do_async("key", build) for _ in range(5))) == [1] * 5
+        results = await asyncio.gather(*(flight.do_async("key", fail) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert len(flight) == 0 # 失敗しても次の呼び出しでやり直せる
+
+
+def test_search_rebuilds_index_only_when_board_changes(db, make_board, monkeypatch):
+    if db.get_bind().dialect.name == "postgresql":
+        pytest.skip("PostgreSQL はメモリ内インデックスを使わない")
+    board = make_board(bump_version=True)
+    builds = []
+
+    class CountingIndex(main.PrefixIndex):
+        def __init__(self, rows):
+            builds.append(len(rows))
+            super().__init__(rows)
+
+    monkeypatch.setattr(main, "PrefixIndex", CountingIndex)
+    main.search_index_cache.clear()
+
+    def search(q):
+        return main.search_sites(q=q, limit=20, offset=0, db=db, current_user=board.current_user)["results"]
+
+    assert [site["id"] for site in search("site1")] == [board.site_ids[1]]
+    assert search("site") and builds == [3]
+
+    site = db.get(main.Site, board.site_ids[0])
+    site.title = "renamed"
+    site.change_seq = main.bump_board_version(db, board.user.id)
+    db.commit()
+    assert [site["id"] for site in search("renamed")] == [board.site_ids[0]]
+    assert builds == [3, 3]
@@ -16,7 +16,7 @@ chrome.tabs.query({ active: true, currentWindow: true }, function(tabs) {
 });
 
 // 2. FastAPIサーバーからカテゴリ一覧を取得して、セレクトボックスに表示する
-fetch(`${API_URL}/api/categories`)
+fetch(`${API_URL}/api/categories/names`) // サイトは不要なのでカテゴリ名だけを取得
   .then(response => response.json())
   .then(categories => {
     categorySelect.innerHTML = '<option value="" disabled selected>カテゴリを選択</option>';
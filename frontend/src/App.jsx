@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useMemo, useCallback } from 'react';
+import React, { useState, useEffect, useMemo, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { DndContext, closestCenter, KeyboardSensor, PointerSensor, useSensor, useSensors } from '@dnd-kit/core';
 import { arrayMove, SortableContext, sortableKeyboardCoordinates, rectSortingStrategy, verticalListSortingStrategy } from '@dnd-kit/sortable';
@@ -9,6 +9,10 @@ import { jwtDecode } from 'jwt-decode'; // jwt-decodeをインポート
 import './App.css';
 
 const API_URL = 'http://127.0.0.1:8000';
+// サイトの登録直後はこのタイトルで保存され、バックエンドがページのタイトルを取得して書き換える (metadata_fetcher.TITLE_PLACEHOLDER)
+const TITLE_PLACEHOLDER = 'タイトル取得中...';
+const PENDING_TITLE_POLL_MS = 2000; // 取得中のサイトがある間、この間隔から倍々で差分を取り直す
+const PENDING_TITLE_POLL_MAX_MS = 30000;
 
 // --- axiosの共通設定（会員証を自動で提示する仕組み） ---
 // これを設定することで、今後axiosを使うすべての通信で自動的にトークンがヘッダーに追加されます。
@@ -180,6 +184,33 @@ function App() {
   return <Dashboard onLogout={handleLogout} user={user} />;
 }
 
+// --- 差分同期 (/api/changes) の結果を手元のカテゴリ一覧に反映する ---
+// 削除を先に適用し、そのあと変更のあったカテゴリ/サイトを上書きします。
+const byDisplayOrder = (a, b) => a.display_order - b.display_order || a.id - b.id;
+
+function applyChanges(prev, changes) {
+  const deletedCategories = new Set(changes.deleted_categories);
+  const deletedSites = new Set(changes.deleted_sites);
+  const changedSites = new Set(changes.sites.map(site => site.id));
+  const byId = new Map();
+  for (const category of changes.full ? [] : prev) {
+    if (deletedCategories.has(category.id)) continue;
+    byId.set(category.id, {
+      ...category,
+      sites: category.sites.filter(site => !deletedSites.has(site.id) && !changedSites.has(site.id)),
+    });
+  }
+  for (const category of changes.categories) {
+    byId.set(category.id, { ...category, sites: byId.get(category.id)?.sites || [] });
+  }
+  for (const { category_id, ...site } of changes.sites) {
+    byId.get(category_id)?.sites.push(site);
+  }
+  const next = [...byId.values()].sort(byDisplayOrder);
+  next.forEach(category => category.sites.sort(byDisplayOrder));
+  return next;
+}
+
 // --- ダッシュボード部分を別のコンポーネントに分離 ---
 function Dashboard({ onLogout, user }) {
   const [categories, setCategories] = useState([]);
@@ -189,10 +220,17 @@ function Dashboard({ onLogout, user }) {
 
   const sensors = useSensors(useSensor(PointerSensor), useSensor(KeyboardSensor, { coordinateGetter: sortableKeyboardCoordinates }));
   
+  const versionRef = useRef(0); // 最後に反映したボードのバージョン
+
   // useCallbackを使って、不要な再生成を防ぐ
+  // 前回のバージョン以降の変更だけを取得する (初回は全件)
   const fetchData = useCallback(() => {
-    axios.get(`${API_URL}/api/categories`)
-      .then(res => setCategories(res.data))
+    axios.get(`${API_URL}/api/changes`, { params: { since: versionRef.current } })
+      .then(res => {
+        if (res.data.version < versionRef.current) return; // 追い越された古いレスポンスは捨てる
+        versionRef.current = res.data.version;
+        setCategories(prev => applyChanges(prev, res.data));
+      })
       .catch(err => {
         console.error("Error fetching data:", err)
         // 401エラー（トークン切れなど）ならログアウトさせる
@@ -206,6 +244,25 @@ function Dashboard({ onLogout, user }) {
     fetchData();
   }, [fetchData]);
 
+  // タイトル取得中のサイトがある間は /api/changes を取り直し、取得結果が反映されたら止める
+  const hasPendingTitle = useMemo(
+    () => categories.some(category => category.sites.some(site => site.title === TITLE_PLACEHOLDER)),
+    [categories]
+  );
+  const pollDelayRef = useRef(PENDING_TITLE_POLL_MS);
+  useEffect(() => {
+    if (!hasPendingTitle) {
+      pollDelayRef.current = PENDING_TITLE_POLL_MS;
+      return;
+    }
+    // fetchData のたびに categories が置き換わるので、この effect が次の取得を予約し直す
+    const timer = setTimeout(() => {
+      pollDelayRef.current = Math.min(pollDelayRef.current * 2, PENDING_TITLE_POLL_MAX_MS);
+      fetchData();
+    }, pollDelayRef.current);
+    return () => clearTimeout(timer);
+  }, [hasPendingTitle, categories, fetchData]);
+
   // (ここから下のハンドラ関数たちは、基本的に変更なし)
   // --- ハンドラ ---
   const handleCreateCategory = e => {
@@ -277,7 +334,7 @@ function Dashboard({ onLogout, user }) {
 
         const newArray = arrayMove(items, oldIndex, newIndex);
         const orderUpdates = newArray.map((cat, index) => ({ id: cat.id, order: index }));
-        axios.post(`${API_URL}/api/update-order/categories`, orderUpdates);
+        axios.post(`${API_URL}/api/layout`, { categories: orderUpdates });
         return newArray;
       });
       return;
@@ -309,20 +366,18 @@ function Dashboard({ onLogout, user }) {
         if (activeContainerId === overContainerId) { // カテゴリ内移動
             newCategories[sourceCatIndex].sites = arrayMove(newCategories[sourceCatIndex].sites, activeIndex, overIndex);
             const orderUpdates = newCategories[sourceCatIndex].sites.map((site, index) => ({ id: site.id, order: index }));
-            axios.post(`${API_URL}/api/update-order/sites`, orderUpdates);
-        } else { // カテゴリ間移動
+            axios.post(`${API_URL}/api/layout`, { sites: orderUpdates });
+        } else { // カテゴリ間移動 (並び順と移動を1回のリクエストでまとめて反映)
             const [movedItem] = newCategories[sourceCatIndex].sites.splice(activeIndex, 1);
             newCategories[destCatIndex].sites.splice(overIndex, 0, movedItem);
 
-            const sourceOrderUpdates = newCategories[sourceCatIndex].sites.map((site, index) => ({ id: site.id, order: index }));
-            axios.post(`${API_URL}/api/update-order/sites`, sourceOrderUpdates);
-            
-            const destOrderUpdates = newCategories[destCatIndex].sites.map((site, index) => ({ id: site.id, order: index }));
-            axios.post(`${API_URL}/api/update-order/sites`, destOrderUpdates);
-            
-            const siteId = parseInt(activeId.replace('site-', ''));
-            const newCategoryId = parseInt(overContainerId.replace('category-', ''));
-            axios.post(`${API_URL}/api/move-site`, { site_id: siteId, new_category_id: newCategoryId });
+            const sourceCategoryId = newCategories[sourceCatIndex].id;
+            const destCategoryId = newCategories[destCatIndex].id;
+            const siteUpdates = [
+              ...newCategories[sourceCatIndex].sites.map((site, index) => ({ id: site.id, order: index, category_id: sourceCategoryId })),
+              ...newCategories[destCatIndex].sites.map((site, index) => ({ id: site.id, order: index, category_id: destCategoryId })),
+            ];
+            axios.post(`${API_URL}/api/layout`, { sites: siteUpdates });
         }
         return newCategories;
       });